@@ -1,16 +1,28 @@
 import streamlit as st
 import os
-import base64
-import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta, time
+from time import monotonic
 
 # Custom modules
-from src.config import MIN_DATE, DATABASE_NAME, TELESCOPES, DEFAULT_TELESCOPE, ICON_PATH
-from src.style import apply_custom_styles
-from src.database import get_db, get_mongo_connection_info, get_filtered_collections, fetch_data
-from src.processor import process_data_by_var
-from src.plot import generate_plot
+from src.config import (
+    MIN_DATE, DATABASE_NAME, TELESCOPES, DEFAULT_TELESCOPE, ICON_PATH, PLOT_WIDTH_PX, DOWNSAMPLE_MIN_RANGE,
+    ALLOWED_SUFFIXES, AUTO_POINT_BUDGET, PARTIAL_RENDER_INTERVAL_S,
+    EXPORT_DIR, EXPORT_WINDOW, EXPORT_DOWNLOAD_MAX_BYTES, EXPORT_FORMATS, LIVE_REFRESH_S, MAX_NIGHTS, TABLE_PAGE_SIZE,
+    CACHE_SETTLE_TIME, SEARCH_MAX_INTERVALS, SEARCH_ZOOM_MARGIN,
+)
+from src.style import apply_custom_styles, get_base64
+from src.database import (
+    get_db, get_connections, get_mongo_connection_info, get_catalog, fetch_downsampled, choose_resolution,
+    build_query, check_query_size, iter_batches, fetch_columns, fetch_ranges, fetch_telescopes,
+    get_range_cache, get_result_cache, estimate_documents, QueryTooLarge, QueryTimeout,
+)
+from src.processor import ColumnAccumulator, night_ranges, table_page
+from src.cache import to_ms
+from src.diagnostics import check_collections, explain_query
+from src.live import LiveTail, current_night_start, utc_now
+from src.result_cache import result_key
+from src.search import find_intervals
+from src.summary import fetch_summary
 
 # Initial page config (must be set before any Streamlit UI calls)
 st.set_page_config(page_title="CaCo db query engine", layout="wide", page_icon=ICON_PATH)
@@ -44,10 +56,15 @@ if selected_telescope not in TELESCOPES:
     selected_telescope = DEFAULT_TELESCOPE
 st.session_state.selected_telescope = selected_telescope
 
+# Admin tools (index/explain diagnostics) are only shown with ?admin=1
+admin_value = query_params.get("admin", "0")
+is_admin = (admin_value[0] if isinstance(admin_value, (list, tuple)) and admin_value else admin_value) == "1"
+extra_params = {"admin": "1"} if is_admin else {}
+
 if hasattr(st, "experimental_set_query_params"):
-    st.experimental_set_query_params(telescope=selected_telescope)
+    st.experimental_set_query_params(telescope=selected_telescope, **extra_params)
 elif hasattr(st, "set_query_params"):
-    st.set_query_params(telescope=selected_telescope)
+    st.set_query_params(telescope=selected_telescope, **extra_params)
 
 # Apply styles and update browser tab title dynamically via JS
 apply_custom_styles()
@@ -59,21 +76,22 @@ try:
     candidate = os.path.join(base_dir, "static", f"icon_{selected_telescope}.png")
     if not os.path.exists(candidate):
         candidate = ICON_PATH
-    with open(candidate, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
-    st.markdown(f"<link rel='icon' href='data:image/png;base64,{b64}' />", unsafe_allow_html=True)
+    st.markdown(f"<link rel='icon' href='data:image/png;base64,{get_base64(candidate)}' />", unsafe_allow_html=True)
 except Exception:
     pass
 
 sidebar_color = SOFT_TELESCOPE_COLORS.get(selected_telescope, "#F0F2F6")
 st.markdown(f"<style>[data-testid='stSidebar'] {{ background-color: {sidebar_color}; }}</style>", unsafe_allow_html=True)
 
+# Telescopes whose last background health probe failed are greyed out
+connections = get_connections()
 button_row = "<div class='telescope-row'>"
 for telescope_name in TELESCOPES:
     selected_class = "selected" if telescope_name == selected_telescope else ""
+    down_class = "down" if connections.is_reachable(telescope_name) is False else ""
     button_row += (
-        f"<a class='telescope-btn {telescope_name.lower()} {selected_class}' "
-        f"href='?telescope={telescope_name}'>{telescope_name}</a>"
+        f"<a class='telescope-btn {telescope_name.lower()} {selected_class} {down_class}' "
+        f"href='?telescope={telescope_name}{'&admin=1' if is_admin else ''}'>{telescope_name}</a>"
     )
 button_row += "</div>"
 st.sidebar.markdown(button_row, unsafe_allow_html=True)
@@ -94,7 +112,8 @@ except Exception as exc:
 # Sidebar setup + selection logic
 st.sidebar.header("Query parameters")
 try:
-    filtered_collections = get_filtered_collections(db)
+    catalog = get_catalog(st.session_state.selected_telescope)
+    filtered_collections = catalog.collections()
 except Exception as exc:
     st.error(f"Could not read collections for telescope '{selected_telescope}'.")
     st.info(f"Details: {exc}")
@@ -109,18 +128,24 @@ if not filtered_collections:
 base_collections = sorted(list(set(col.rsplit("_", 1)[0] for col in filtered_collections)))
 
 selected_base = st.sidebar.selectbox("Select collection", options=base_collections)
-selected_resolution = st.sidebar.segmented_control("Resolution", options=["min", "hour", "day", "week"], default="min")
-
-selected_col = f"{selected_base}_{selected_resolution}"
-if selected_col not in filtered_collections:
-    st.sidebar.error(f"Collection '{selected_col}' does not exist in DB.")
-    st.stop()
+selected_resolution = st.sidebar.segmented_control(
+    "Resolution", options=["auto", "min", "hour", "day", "week"], default="auto",
+    help="'auto' picks the finest resolution that keeps the plot fast for the selected range",
+)
+use_auto_resolution = selected_resolution in (None, "auto")
 
-col_ref = db[selected_col]
+if use_auto_resolution:
+    # Variables are listed from the finest available resolution
+    catalog_col = next(f"{selected_base}{suffix}" for suffix in ALLOWED_SUFFIXES if f"{selected_base}{suffix}" in filtered_collections)
+else:
+    catalog_col = f"{selected_base}_{selected_resolution}"
+    if catalog_col not in filtered_collections:
+        st.sidebar.error(f"Collection '{catalog_col}' does not exist in DB.")
+        st.stop()
 
 # Variable selection
 try:
-    var_list = np.sort(list(col_ref.distinct("name")))
+    var_list = catalog.variables(catalog_col)
     
     # Style variables multiselect to display in 1 row
     st.markdown("""
@@ -141,6 +166,12 @@ except Exception as e:
     st.error(f"Error fetching variables: {e}")
     st.stop()
 
+var_metadata = [meta for meta in (catalog.metadata(catalog_col, var) for var in selected_vars) if meta and meta["first"]]
+if var_metadata:
+    first_seen = min(meta["first"] for meta in var_metadata)
+    last_seen = max(meta["last"] for meta in var_metadata)
+    st.sidebar.caption(f"Data available from {first_seen:%Y-%m-%d %H:%M} to {last_seen:%Y-%m-%d %H:%M} UTC")
+
 # Time Selection
 def parse_manual_time(time_str, default_time):
     try:
@@ -153,14 +184,19 @@ col_top1, col_top2, _, _ = st.sidebar.columns(4)
 use_night_preset = col_top1.checkbox("Night-wise", value=False)
 use_exact_time = col_top2.checkbox("Detailed time", value=False)
 
+n_nights = 1
 if use_night_preset:
     night_date = st.sidebar.date_input("Night date", value=datetime.now().date(), min_value=MIN_DATE)
+    n_nights = st.sidebar.number_input(
+        "Number of nights", min_value=1, max_value=MAX_NIGHTS, value=1,
+        help="Fetch this many nights, ending with the night date, and overlay them on an 'hours since night start' axis",
+    )
 
     with st.sidebar.expander("Night hours (advanced)", expanded=False):
         night_start_hour = st.number_input("Night start hour (0-23)", min_value=0, max_value=23, value=17)
         night_end_hour = st.number_input("Night end hour (0-23)", min_value=0, max_value=23, value=8)
-        start_dt = datetime.combine(night_date, time(hour=night_start_hour))
-        end_dt = datetime.combine(night_date + timedelta(days=1 if night_end_hour <= night_start_hour else 0), time(hour=night_end_hour))
+    night_list = night_ranges(night_date - timedelta(days=n_nights - 1), night_date, night_start_hour, night_end_hour)
+    start_dt, end_dt = night_list[0][0], night_list[-1][1]
 else:
     if use_exact_time:
 
@@ -186,37 +222,459 @@ else:
         start_dt = datetime.combine(start_date, datetime.min.time())
         end_dt = datetime.combine(end_date, datetime.max.time())
 
+# Zoom: a box selection on the chart, or an interval picked in the interval
+# search, re-runs the query over that window. The window stays active on
+# later reruns until "Fetch data & plot" is pressed or the base query changes.
+selected_range = (start_dt, end_dt)
+if "chart_nonce" not in st.session_state:
+    st.session_state.chart_nonce = 0
+chart_key = f"main_chart_{st.session_state.chart_nonce}"
+chart_state = st.session_state.get(chart_key) or {}
+selection_boxes = [box for box in chart_state.get("selection", {}).get("box", []) if box.get("xref", "x") == "x"]
+zoom_window = st.session_state.pop("zoom_window", None)
+if selection_boxes:
+    import pandas as pd
+
+    zoom_x = pd.to_datetime(selection_boxes[0]["x"]).to_pydatetime()
+    zoom_window = (min(zoom_x), max(zoom_x))
+zoom_base = repr((selected_telescope, selected_base, selected_vars, selected_range))
+zoom_requested = zoom_window is not None
+if zoom_requested:
+    st.session_state.active_zoom = (zoom_base, zoom_window)
+    st.session_state.chart_nonce += 1
+    chart_key = f"main_chart_{st.session_state.chart_nonce}"
+elif st.session_state.get("fetch_button") or st.session_state.get("active_zoom", (None,))[0] != zoom_base:
+    st.session_state.pop("active_zoom", None)
+active_zoom = st.session_state.get("active_zoom")
+if active_zoom:
+    start_dt, end_dt = active_zoom[1]
+
+multi_night = use_night_preset and n_nights > 1 and not active_zoom
+if multi_night:
+    night_view = st.sidebar.segmented_control(
+        "Night view", options=["envelope", "overlay"], default="envelope",
+        help="'envelope' shows the 5-95% band and median across nights, 'overlay' one line per night",
+    )
+
+if use_auto_resolution:
+    # Only the nights themselves count towards the point budget, not the days in between
+    budget_end = start_dt + n_nights * (night_list[0][1] - night_list[0][0]) if multi_night else end_dt
+    selected_col = choose_resolution(selected_base, filtered_collections, start_dt, budget_end, max(1, len(selected_vars)), AUTO_POINT_BUDGET)
+    st.sidebar.caption(f"Auto resolution: {selected_col.rsplit('_', 1)[1]}")
+else:
+    selected_col = catalog_col
+col_ref = db[selected_col]
+
 show_y_projection = st.sidebar.checkbox("Show Y-axis projection histogram", value=False)
+fast_render = st.sidebar.checkbox("Fast rendering (WebGL)", value=True, help="Draw with WebGL and keep only the min/max points per pixel of each series")
+correlation_view = st.sidebar.checkbox(
+    "Correlation view", value=False,
+    help="Plot the second variable against the first, pairing each sample with the last one of the other variable",
+)
+fetch_mode = st.sidebar.segmented_control(
+    "Fetch mode", options=["auto", "full", "downsampled", "summary"], default="auto",
+    help=f"'auto' downsamples on the server for ranges of {DOWNSAMPLE_MIN_RANGE.days} days or more; "
+    "'summary' only computes statistics on the server, without plotting",
+)
+summary_mode = fetch_mode == "summary"
+compare_telescopes = st.sidebar.multiselect(
+    "Compare with telescopes", options=[name for name in TELESCOPES if name != selected_telescope],
+    help="Fetch the same variables and range from other telescopes at once and overlay them",
+)
+use_cache = st.sidebar.checkbox("Use local cache", value=True, help="Re-use previously fetched ranges and results (also those of other sessions) and only query the missing time gaps")
+use_downsampling = not multi_night and (fetch_mode == "downsampled" or (fetch_mode == "auto" and end_dt - start_dt >= DOWNSAMPLE_MIN_RANGE))
+live_mode = st.sidebar.checkbox(
+    "Live mode (current night)", value=False,
+    help=f"Follow the current night on the finest resolution, polling every {LIVE_REFRESH_S}s for new samples only",
+)
+
+def run_guarded(fetch, *args, **kwargs):
+    """Runs a size-checked fetch, asking the user to confirm first if the query is too large."""
+    query_counts = st.session_state.setdefault("query_counts", {})
+    try:
+        return fetch(*args, known_counts=query_counts, **kwargs)
+    except QueryTooLarge as exc:
+        st.warning(f"(!) {exc}")
+        st.info("Large queries can slow down the cluster. Are you sure you need all this data?")
+
+        # Require user confirmation to proceed. On first run this will render
+        # the button and then call `st.stop()` to avoid executing the heavy query.
+        if not st.button("Download anyway"):
+            st.stop()
+        return fetch(*args, known_counts=query_counts, confirmed=True, **kwargs)
+
+def shared_result(kind, telescope, ranges, fetch, *args, cacheable=None, collection_name=None, **kwargs):
+    """Runs a fetch through the result cache shared by all sessions, when the local cache is enabled.
+
+    Sessions asking for the same variables and ranges at the same time share
+    one query. Per-variable results come back in the order of `selected_vars`.
+    """
+    if not use_cache:
+        return fetch(*args, **kwargs)
+    key = result_key(kind, telescope, collection_name or selected_col, selected_vars, ranges)
+    immutable = max(end for _, end in ranges) <= utc_now() - CACHE_SETTLE_TIME
+    result = get_result_cache().get_or_compute(key, lambda: fetch(*args, **kwargs), immutable, cacheable)
+    if kind.startswith("compare"):
+        return result
+    return {var: result[var] for var in selected_vars if var in result}
+
+@st.fragment(run_every=LIVE_REFRESH_S)
+def live_view(collection, selected_vars, show_y_projection, fast_render):
+    """Polls for samples newer than the last seen ones and redraws only the live chart."""
+    from src.plot import generate_plot
+
+    night_start = current_night_start(utc_now())
+    tail_key = (selected_telescope, collection.name, tuple(selected_vars), night_start)
+    if st.session_state.get("live_tail_key") != tail_key:
+        st.session_state.live_tail = LiveTail(collection, selected_vars, night_start)
+        st.session_state.live_tail_key = tail_key
+    tail = st.session_state.live_tail
+
+    try:
+        tail.poll()
+    except QueryTimeout as exc:
+        st.warning(str(exc))
+
+    data_by_var = tail.columns()
+    if not any(len(cols["date"]) for cols in data_by_var.values()):
+        st.info(f"No data yet for {selected_vars} since {night_start:%Y-%m-%d %H:%M} UTC. Waiting for new samples...")
+        return
+    fig = generate_plot(data_by_var, selected_vars, show_y_projection, False, night_start, utc_now(), fast_render=fast_render)
+    st.plotly_chart(fig, width="stretch", key="live_chart")
+    last_sample = max(cols["date"][-1] for cols in data_by_var.values() if len(cols["date"]))
+    st.caption(f"Live since {night_start:%Y-%m-%d %H:%M} UTC, last sample {last_sample.astype(datetime):%H:%M:%S} UTC. Refreshed every {LIVE_REFRESH_S}s.")
+
+@st.fragment
+def export_panel(collection, telescope, selected_vars, start_dt, end_dt, use_cache):
+    """Export controls; their reruns stay inside the panel and leave the main area alone."""
+    export_format = st.selectbox("Format", options=list(EXPORT_FORMATS))
+    if not st.button("Export selected range"):
+        return
+    if not selected_vars:
+        st.warning("Please select at least one variable.")
+        return
+
+    # Loads pandas (and pyarrow), so only imported once an export is requested
+    from src.export import export_filename, iter_export_chunks, write_export
+
+    export_name = export_filename(telescope, collection.name, selected_vars, start_dt, end_dt, export_format)
+    export_path = os.path.join(EXPORT_DIR, export_name)
+    try:
+        with st.spinner(f"Exporting {', '.join(selected_vars)} to {export_name}..."):
+            chunks = iter_export_chunks(
+                collection, selected_vars, start_dt, end_dt, EXPORT_WINDOW,
+                cache=get_range_cache() if use_cache else None, telescope=telescope,
+            )
+            n_rows = write_export(chunks, export_path, export_format)
+    except (RuntimeError, QueryTimeout) as exc:
+        st.error(f"Export failed: {exc}")
+    else:
+        st.success(f"Exported {n_rows:,} rows to {export_path}")
+        if os.path.getsize(export_path) <= EXPORT_DOWNLOAD_MAX_BYTES:
+            with open(export_path, "rb") as f:
+                st.download_button(label=f"Download {export_format.upper()}", data=f, file_name=export_name, on_click="ignore")
+        else:
+            st.info("The file is too large to download through the browser; copy it from the server path above.")
+
+@st.fragment
+def diagnostics_panel(db, collection, query):
+    """Admin index/explain checks, rerun on their own.
+
+    Read-only: missing indexes are reported, and only built from the
+    command line (`python -m src.diagnostics --create-indexes`).
+    """
+    if st.button("Check collections"):
+        with st.spinner("Checking indexes and query plans..."):
+            st.dataframe(check_collections(db), hide_index=True)
+        st.caption("Build missing indexes with `python -m src.diagnostics --create-indexes`.")
+    if query and st.button("Explain current query"):
+        st.json(explain_query(collection, query))
+    st.markdown("**Connections**")
+    st.dataframe(get_connections().status(), hide_index=True)
+    st.markdown("**Shared result cache**")
+    st.dataframe([get_result_cache().stats()], hide_index=True)
+
+@st.fragment
+def raw_table(data_by_var, table_id):
+    """Paginated raw data table; only the visible page is built and sent to the browser.
+
+    Pages are keyset-paginated on date (see `table_page`), and the cursors of
+    the pages visited are kept in the session so "Previous" walks back.
+    """
+    if not st.toggle("Show raw data table", value=False):
+        return
+
+    col_vars, col_order, col_min, col_max = st.columns([3, 2, 1, 1])
+    names = col_vars.multiselect("Variables", options=list(data_by_var), default=list(data_by_var), key="table_vars")
+    descending = col_order.segmented_control("Date order", ["ascending", "descending"], default="ascending", key="table_order") == "descending"
+    value_min = col_min.number_input("Min avg", value=None, key="table_min")
+    value_max = col_max.number_input("Max avg", value=None, key="table_max")
+    seek_str = st.text_input("Jump to date (UTC, YYYY-MM-DD HH:MM:SS)", value="", key="table_seek")
+
+    seek_cursor = None
+    if seek_str.strip():
+        try:
+            seek_ms = to_ms(datetime.fromisoformat(seek_str.strip()))
+            # Sorts before (ascending) or after (descending) every row at that date
+            seek_cursor = (seek_ms, "\uffff", -1) if descending else (seek_ms, "", -1)
+        except ValueError:
+            st.warning("Invalid date, showing the first page.")
+
+    state_key = (table_id, tuple(names), descending, value_min, value_max, seek_cursor)
+    state = st.session_state.get("table_state")
+    if state is None or state["key"] != state_key:
+        state = {"key": state_key, "cursors": [seek_cursor]}
+        st.session_state.table_state = state
+    cursors = state["cursors"]
+
+    page, next_cursor, n_rows = table_page(
+        {name: data_by_var[name] for name in names}, TABLE_PAGE_SIZE, cursors[-1], descending, (value_min, value_max)
+    )
+
+    import pandas as pd
+
+    st.dataframe(pd.DataFrame(page), hide_index=True)
+    col_first, col_prev, col_next, col_info = st.columns([1, 1, 1, 4])
+    col_first.button("First", disabled=len(cursors) == 1, on_click=lambda: cursors.__delitem__(slice(1, None)), key="table_first")
+    col_prev.button("Previous", disabled=len(cursors) == 1, on_click=cursors.pop, key="table_prev")
+    col_next.button("Next", disabled=next_cursor is None, on_click=cursors.append, args=(next_cursor,), key="table_next")
+    col_info.caption(f"Page {len(cursors)}, {len(page['date']):,} of {n_rows:,} matching rows")
+
+@st.fragment
+def search_panel(collection, telescope, selected_vars, start_dt, end_dt):
+    """Out-of-range interval search, run on the server; a found interval can be zoomed into."""
+    if not selected_vars:
+        st.caption("Select variables to search.")
+        return
+    conditions = {}
+    for var in selected_vars:
+        col_name, col_low, col_high = st.columns([2, 1, 1])
+        col_name.markdown(f"`{var}`")
+        conditions[var] = (
+            col_low.number_input("Below", value=None, key=f"search_low_{var}"),
+            col_high.number_input("Above", value=None, key=f"search_high_{var}"),
+        )
+
+    search_key = repr((telescope, collection.name, conditions, start_dt, end_dt))
+    if st.button("Search intervals"):
+        if all(low is None and high is None for low, high in conditions.values()):
+            st.warning("Please set a lower or upper bound for at least one variable.")
+        else:
+            try:
+                with st.spinner(f"Searching {start_dt:%Y-%m-%d} to {end_dt:%Y-%m-%d}..."):
+                    st.session_state.search_result = {"key": search_key, "intervals": find_intervals(collection, conditions, start_dt, end_dt)}
+            except QueryTimeout as exc:
+                st.error(str(exc))
+
+    result = st.session_state.get("search_result")
+    if result is None or result["key"] != search_key:
+        return
+    rows = sorted(
+        ({"variable": var, **interval} for var, intervals in result["intervals"].items() for interval in intervals),
+        key=lambda row: row["start"],
+    )
+    if not rows:
+        st.info(f"No sample out of range from {start_dt:%Y-%m-%d %H:%M} to {end_dt:%Y-%m-%d %H:%M} UTC.")
+        return
+    st.caption(f"{len(rows):,} intervals" + (f" (only the first {SEARCH_MAX_INTERVALS:,})" if len(rows) >= SEARCH_MAX_INTERVALS else ""))
+    st.dataframe(rows, hide_index=True)
+    choice = st.selectbox(
+        "Interval", options=range(len(rows)),
+        format_func=lambda i: f"{rows[i]['variable']}: {rows[i]['start']:%Y-%m-%d %H:%M:%S} ({rows[i]['duration']})",
+    )
+    if st.button("Zoom to interval"):
+        # Picked up by the zoom logic at the top of the next full run
+        st.session_state.zoom_window = (rows[choice]["start"] - SEARCH_ZOOM_MARGIN, rows[choice]["end"] + SEARCH_ZOOM_MARGIN)
+        st.rerun()
 
 # Plotting
-if st.sidebar.button("Fetch data & plot"):
+# A request stays pending while it waits for the large-query confirmation.
+# The last result is kept, so reruns that do not change the query (display
+# options) redraw it without fetching again.
+request_key = repr((selected_telescope, selected_col, selected_vars, start_dt, end_dt, use_downsampling, compare_telescopes))
+fetch_clicked = st.sidebar.button("Fetch data & plot", key="fetch_button")
+last_result = st.session_state.get("last_result")
+reuse_result = not fetch_clicked and last_result is not None and last_result["key"] == request_key
+if live_mode:
+    if not selected_vars:
+        st.warning("Please select at least one variable.")
+    else:
+        st.markdown(f"### <span style='color: #00CED1;'>{catalog_col} (live):</span> {', '.join(selected_vars)}", unsafe_allow_html=True)
+        live_view(db[catalog_col], selected_vars, show_y_projection, fast_render)
+elif summary_mode and (fetch_clicked or st.session_state.get("summary_request") == request_key):
+    if not selected_vars:
+        st.warning("Please select at least one variable.")
+    else:
+        # Statistics are computed on the server, so the finest resolution costs no transfer
+        st.session_state.summary_request = request_key
+        st.markdown(f"### <span style='color: #00CED1;'>{catalog_col} (summary):</span> {', '.join(selected_vars)}", unsafe_allow_html=True)
+        st.caption(f"Computed on the server from {start_dt:%Y-%m-%d %H:%M} to {end_dt:%Y-%m-%d %H:%M} UTC; percentiles are approximate.")
+        try:
+            with st.spinner("Computing summary..."):
+                summary = shared_result(
+                    "summary", selected_telescope, [(start_dt, end_dt)], fetch_summary, db[catalog_col], selected_vars, start_dt, end_dt,
+                    collection_name=catalog_col,
+                )
+        except QueryTimeout as exc:
+            st.error(str(exc))
+            summary = {}
+        for var, var_summary in summary.items():
+            st.markdown(f"**{var}**")
+            if var_summary["stats"] is None:
+                st.info("No samples in the selected range.")
+                continue
+            st.dataframe([var_summary["stats"]], hide_index=True)
+            if var_summary["states"]:
+                st.dataframe(
+                    [
+                        {"state": row["state"], "time": timedelta(milliseconds=row["duration_ms"]), "fraction": row["fraction"], "samples": row["samples"]}
+                        for row in var_summary["states"]
+                    ],
+                    hide_index=True,
+                    column_config={"fraction": st.column_config.ProgressColumn("fraction", format="percent", min_value=0, max_value=1)},
+                )
+elif fetch_clicked or zoom_requested or reuse_result or st.session_state.get("pending_request") == request_key:
     if not selected_vars:
         st.warning("Please select at least one variable.")
     else:
-        all_data = fetch_data(col_ref, selected_vars, start_dt, end_dt)
-        
-        if not all_data:
+        # Plotly figures are built only once there is data to show
+        from src.plot import generate_plot, generate_array_plot, generate_array_heatmap, generate_night_plot, generate_correlation_plot
+
+        st.session_state.pending_request = request_key
+        plot_x_range = use_night_preset or bool(active_zoom) or (reuse_result and last_result["plot_x_range"])
+
+        # Display Header
+        st.markdown(f"### <span style='color: #00CED1;'>{selected_col}:</span> {', '.join(selected_vars)}", unsafe_allow_html=True)
+        if use_downsampling:
+            st.caption(f"Downsampled on the server to at most {PLOT_WIDTH_PX} bins per variable (mean with min/max band).")
+        if active_zoom:
+            st.caption(f"Zoomed to {start_dt:%Y-%m-%d %H:%M:%S} – {end_dt:%Y-%m-%d %H:%M:%S}. Press 'Fetch data & plot' to reset.")
+        chart_placeholder = st.empty()
+
+        var_names = None
+        if reuse_result:
+            data_by_var, var_names = last_result["data_by_var"], last_result["var_names"]
+        elif multi_night:
+            # All nights in one parallel batch, only the hours of each night
+            with st.spinner(f"Fetching {n_nights} nights..."):
+                try:
+                    data_by_var = run_guarded(
+                        shared_result, "ranges", selected_telescope, night_list, fetch_ranges, col_ref, selected_telescope, selected_vars, night_list,
+                        cache=get_range_cache() if use_cache else None,
+                    )
+                except QueryTimeout as exc:
+                    st.error(str(exc))
+                    data_by_var = exc.data_by_var
+        elif compare_telescopes:
+            telescopes = [selected_telescope] + compare_telescopes
+            with st.spinner(f"Fetching from {', '.join(telescopes)}..."):
+                # Results with a failed telescope are not shared, so the next request retries it
+                data_by_telescope, errors = run_guarded(
+                    shared_result, "compare_downsampled" if use_downsampling else "compare", tuple(telescopes), [(start_dt, end_dt)],
+                    fetch_telescopes, telescopes, selected_col, selected_vars, start_dt, end_dt,
+                    n_bins=PLOT_WIDTH_PX if use_downsampling else None, cache=get_range_cache() if use_cache else None,
+                    cacheable=lambda result: not result[1],
+                )
+            for telescope, message in errors.items():
+                st.warning(f"{telescope}: {message}")
+            data_by_var, var_names = {}, {}
+            for telescope, telescope_data in data_by_telescope.items():
+                for var in selected_vars:
+                    if var in telescope_data:
+                        data_by_var[f"{telescope} · {var}"] = telescope_data[var]
+                        var_names[f"{telescope} · {var}"] = var
+        elif use_downsampling:
+            try:
+                data_by_var = shared_result("downsampled", selected_telescope, [(start_dt, end_dt)], fetch_downsampled, col_ref, selected_vars, start_dt, end_dt, PLOT_WIDTH_PX)
+            except QueryTimeout as exc:
+                st.error(str(exc))
+                data_by_var = {}
+        else:
+            progress = st.progress(0.0, text="Fetching data...")
+
+            def report_progress(n_docs, count):
+                fraction = min(1.0, n_docs / count) if count else 0.0
+                progress.progress(fraction, text=f"Fetched {n_docs:,} of {count:,} documents")
+
+            if use_cache:
+                try:
+                    data_by_var = run_guarded(
+                        shared_result, "columns", selected_telescope, [(start_dt, end_dt)],
+                        fetch_columns, col_ref, selected_telescope, selected_vars, start_dt, end_dt, on_progress=report_progress, cache=get_range_cache(),
+                    )
+                except QueryTimeout as exc:
+                    st.error(str(exc))
+                    data_by_var = exc.data_by_var
+            else:
+                # Stream the query batch by batch, redrawing a partial plot while it runs
+                estimate = estimate_documents(col_ref, [(var, start_dt, end_dt) for var in selected_vars], catalog)
+                accumulator = ColumnAccumulator(selected_vars)
+                last_render = monotonic()
+                try:
+                    count = run_guarded(check_query_size, col_ref, build_query(selected_vars, start_dt, end_dt), estimate)
+                    for batch in iter_batches(col_ref, selected_vars, start_dt, end_dt):
+                        accumulator.add(batch)
+                        report_progress(accumulator.n_docs, count)
+                        if monotonic() - last_render > PARTIAL_RENDER_INTERVAL_S:
+                            partial_fig = generate_plot(accumulator.result(), selected_vars, show_y_projection, True, start_dt, end_dt, fast_render=fast_render)
+                            chart_placeholder.plotly_chart(partial_fig, width="stretch")
+                            last_render = monotonic()
+                except QueryTimeout as exc:
+                    st.error(str(exc))
+                data_by_var = accumulator.result()
+            progress.empty()
+
+        st.session_state.pending_request = None
+        st.session_state.last_result = {"key": request_key, "data_by_var": data_by_var, "var_names": var_names, "plot_x_range": plot_x_range}
+
+        if not any(len(cols["date"]) for cols in data_by_var.values()):
+            chart_placeholder.empty()
             st.warning(f"No data found for {selected_vars} in the selected date range.")
+        elif correlation_view and len(data_by_var) == 2:
+            (x_label, x_cols), (y_label, y_cols) = data_by_var.items()
+            fig, stats = generate_correlation_plot(x_label, x_cols, y_label, y_cols)
+            chart_placeholder.plotly_chart(fig, width="stretch")
+            if stats["n"]:
+                coefficients = [f"{name} r = {stats[key]:.3f}" for key, name in (("pearson", "Pearson"), ("spearman", "Spearman")) if stats[key] is not None]
+                st.caption(" | ".join(coefficients) or "Correlation undefined: one of the variables is constant.")
+        elif multi_night:
+            night_hours = (night_list[0][1] - night_list[0][0]).total_seconds() / 3600
+            fig = generate_night_plot(data_by_var, [night_start for night_start, _ in night_list], night_hours, night_view or "envelope")
+            chart_placeholder.plotly_chart(fig, width="stretch")
         else:
-            # Process data
-            data_by_var = process_data_by_var(all_data, selected_vars)
-            
-            # Display Header
-            st.markdown(f"### <span style='color: #00CED1;'>{selected_col}:</span> {', '.join(selected_vars)}", unsafe_allow_html=True)
-            
+            if correlation_view:
+                st.info("The correlation view needs exactly two variables (or one variable from two telescopes).")
             # Generate  plot
-            fig = generate_plot(data_by_var, selected_vars, show_y_projection, use_night_preset, start_dt, end_dt)
-            st.plotly_chart(fig, width="stretch")
-            
-            # Table and download
-            all_df = pd.DataFrame(all_data)
-            all_df = all_df.drop(columns=["_id", "hierarchical_name"], errors="ignore")
-            with st.expander("View raw data table"):
-                st.write(all_df.sort_values("date"))
-            csv = all_df.to_csv(index=False).encode("utf-8")
-            st.download_button(label="Download CSV", data=csv, file_name=f"{selected_col}_{'_'.join(selected_vars)}.csv", mime="text/csv")
+            fig = generate_plot(data_by_var, selected_vars, show_y_projection, plot_x_range, start_dt, end_dt, var_names=var_names, fast_render=fast_render)
+            chart_placeholder.plotly_chart(fig, width="stretch", key=chart_key, on_select="rerun", selection_mode="box")
+            st.caption("Box-select a time window on the chart to zoom in (finer resolution in 'auto' mode).")
+
+        if any(len(cols["date"]) for cols in data_by_var.values()):
+            # Per-element views of array variables (pixels/modules)
+            for label, cols in data_by_var.items():
+                if "matrix" in cols and len(cols["date"]):
+                    with st.expander(f"Per-element view: {label} ({cols['matrix'].shape[1]} elements)"):
+                        tab_spread, tab_heatmap = st.tabs(["Percentiles & worst elements", "Heatmap"])
+                        tab_spread.plotly_chart(generate_array_plot(label, cols), width="stretch")
+                        tab_heatmap.plotly_chart(generate_array_heatmap(label, cols), width="stretch")
+
+            raw_table(data_by_var, request_key)
+
+# Export: streamed to a file on demand, independently of the plot size limits
+with st.sidebar.expander("Export data", expanded=False):
+    export_panel(col_ref, selected_telescope, selected_vars, start_dt, end_dt, use_cache)
+
+# Search on the finest collection, over the range selected before any zoom
+with st.expander("Search out-of-range intervals", expanded=False):
+    search_panel(db[catalog_col], selected_telescope, selected_vars, *selected_range)
+
+if is_admin:
+    with st.expander("Diagnostics (admin)", expanded=False):
+        diagnostics_panel(db, col_ref, build_query(selected_vars, start_dt, end_dt) if selected_vars else None)
 
 st.sidebar.markdown("---")
-st.sidebar.caption(f"Connected to MongoDB | {host}:{port} | DB: {DATABASE_NAME}")
+ping_ms = next(row["ping_ms"] for row in connections.status() if row["telescope"] == selected_telescope)
+ping_text = f" | ping {ping_ms:.0f} ms" if ping_ms is not None else ""
+st.sidebar.caption(f"Connected to MongoDB | {host}:{port} | DB: {DATABASE_NAME}{ping_text}")
 st.sidebar.caption("Problems or suggestions: juan.jimenez@ifae.es")
 
@@ -0,0 +1,60 @@
+"""Cold-start and rerun timing of the Streamlit app, run headless through `AppTest`.
+
+Usage:
+    python -m src.benchmark [--telescope LST1] [--reruns 20]
+
+Run it on a host that can reach the telescope DB, in a fresh interpreter:
+the first run includes every module import the app triggers.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from streamlit.testing.v1 import AppTest
+
+from src.config import TELESCOPES, DEFAULT_TELESCOPE, repo_root
+
+# Modules whose import is deferred until a fetch or an export happens
+LAZY_MODULES = ["pandas", "src.plot", "src.export"]
+
+
+def _timed_run(at):
+    start = time.perf_counter()
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"App raised: {at.exception[0].value}")
+    return (time.perf_counter() - start) * 1000
+
+
+def _summary(label, times_ms):
+    print(f"{label:<32} median {statistics.median(times_ms):8.1f} ms   min {min(times_ms):8.1f} ms   (n={len(times_ms)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time cold start and reruns of the CaCo app.")
+    parser.add_argument("--telescope", default=DEFAULT_TELESCOPE, choices=list(TELESCOPES))
+    parser.add_argument("--reruns", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120, help="per-run timeout (seconds)")
+    args = parser.parse_args()
+
+    at = AppTest.from_file(os.path.join(repo_root, "app.py"), default_timeout=args.timeout)
+    at.query_params["telescope"] = args.telescope
+
+    _summary("cold start (first run)", [_timed_run(at)])
+    print("deferred modules loaded:", ", ".join(m for m in LAZY_MODULES if m in sys.modules) or "none")
+
+    _summary("rerun (no change)", [_timed_run(at) for _ in range(args.reruns)])
+
+    toggle = next(box for box in at.sidebar.checkbox if box.label.startswith("Show Y-axis projection"))
+    toggle_times = []
+    for _ in range(args.reruns):
+        toggle.set_value(not toggle.value)
+        toggle_times.append(_timed_run(at))
+        toggle = next(box for box in at.sidebar.checkbox if box.label.startswith("Show Y-axis projection"))
+    _summary("rerun (sidebar toggle)", toggle_times)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+import numpy as np
+
+from src.processor import concat_columns, empty_columns
+
+INDEX_FILE = "index.json"
+LOCK_FILE = ".lock"
+
+# Merge a variable's chunk files into one when it has more than this many
+MAX_CHUNKS_PER_KEY = 16
+
+
+def to_ms(dt):
+    """Converts a naive UTC datetime (or datetime64) to integer milliseconds."""
+    return int(np.datetime64(dt, "ms").astype(np.int64))
+
+
+def from_ms(ms):
+    """Converts integer milliseconds back to a naive UTC datetime."""
+    return datetime(1970, 1, 1) + timedelta(milliseconds=int(ms))
+
+
+def merge_intervals(intervals):
+    """Merges overlapping or touching half-open [start, end) intervals."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_intervals(start, end, covered):
+    """Returns the parts of [start, end) not covered by the sorted, merged `covered` list."""
+    gaps = []
+    cursor = start
+    for c_start, c_end in covered:
+        if c_end <= cursor:
+            continue
+        if c_start >= end:
+            break
+        if c_start > cursor:
+            gaps.append((cursor, c_start))
+        cursor = max(cursor, c_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def clip_columns(columns, start_ms, end_ms):
+    """Keeps the rows with start_ms <= date < end_ms."""
+    dates = columns["date"].astype(np.int64)
+    lo, hi = np.searchsorted(dates, start_ms, "left"), np.searchsorted(dates, end_ms, "left")
+    return {key: col[lo:hi] for key, col in columns.items()}
+
+
+class RangeCache:
+    """On-disk cache of expanded columns keyed by (telescope, collection, variable).
+
+    Each key is a directory holding `.npz` chunk files plus an `index.json`
+    with the merged time intervals already fetched (in ms, half-open) and
+    the last access time. When the total size exceeds `max_bytes`, whole
+    keys are evicted, least recently used first. The size and last access
+    of every key are read from disk once, then kept up to date in memory.
+    Updates of a key hold a file lock in its directory, so several
+    processes (e.g. parallel CLI extractions) can share the cache.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._usage = None
+        self._total_bytes = 0
+
+    def _key_dir(self, key):
+        telescope, collection, var = key
+        safe_var = re.sub(r"[^\w.-]", "_", var)
+        digest = hashlib.sha1(var.encode()).hexdigest()[:8]
+        return os.path.join(self.root, telescope, collection, f"{safe_var}-{digest}")
+
+    def _read_index(self, key_dir):
+        try:
+            with open(os.path.join(key_dir, INDEX_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"intervals": [], "chunks": [], "last_access": 0.0}
+
+    def _write_index(self, key_dir, index):
+        os.makedirs(key_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=key_dir, prefix=INDEX_FILE, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(key_dir, INDEX_FILE))
+        self._track(key_dir, index)
+
+    @contextmanager
+    def _locked(self, key_dir):
+        """Holds the thread lock and the key's file lock, which other processes respect too."""
+        with self._lock:
+            os.makedirs(key_dir, exist_ok=True)
+            with open(os.path.join(key_dir, LOCK_FILE), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _load_usage(self):
+        """Returns `{key_dir: [last_access, bytes]}`, walking the cache tree only the first time."""
+        if self._usage is None:
+            self._usage, self._total_bytes = {}, 0
+            for dirpath, _, filenames in os.walk(self.root):
+                if INDEX_FILE in filenames:
+                    self._track(dirpath, self._read_index(dirpath))
+        return self._usage
+
+    def _track(self, key_dir, index):
+        if self._usage is None:
+            return
+        size = sum(chunk["bytes"] for chunk in index["chunks"])
+        previous = self._usage.get(key_dir)
+        self._total_bytes += size - (previous[1] if previous else 0)
+        self._usage[key_dir] = [index["last_access"], size]
+
+    def missing(self, key, start_ms, end_ms):
+        """Returns the [start, end) gaps of the requested range that are not cached."""
+        with self._lock:
+            index = self._read_index(self._key_dir(key))
+        return subtract_intervals(start_ms, end_ms, index["intervals"])
+
+    def store(self, key, start_ms, end_ms, columns):
+        """Stores the columns fetched for [start_ms, end_ms) and marks the range as covered.
+
+        Only the parts not covered yet are written, so a range stored twice
+        (e.g. by two sessions fetching the same gap) never duplicates rows.
+        """
+        key_dir = self._key_dir(key)
+        with self._locked(key_dir):
+            index = self._read_index(key_dir)
+
+            for gap_start, gap_end in subtract_intervals(start_ms, end_ms, index["intervals"]):
+                gap_columns = clip_columns(columns, gap_start, gap_end)
+                if not len(gap_columns["date"]):
+                    continue
+                fname = f"chunk_{gap_start}_{gap_end}.npz"
+                np.savez(os.path.join(key_dir, fname), **gap_columns)
+                index["chunks"].append({
+                    "file": fname,
+                    "start": gap_start,
+                    "end": gap_end,
+                    "bytes": os.path.getsize(os.path.join(key_dir, fname)),
+                })
+
+            index["intervals"] = merge_intervals(index["intervals"] + [[start_ms, end_ms]])
+            index["last_access"] = time.time()
+            if len(index["chunks"]) > MAX_CHUNKS_PER_KEY:
+                index = self._compact(key_dir, index)
+            self._write_index(key_dir, index)
+        self.evict()
+
+    def _compact(self, key_dir, index):
+        """Merges all chunk files of a key into a single one."""
+        columns = concat_columns([self._load_chunk(key_dir, chunk) for chunk in index["chunks"]])
+        start, end = min(chunk["start"] for chunk in index["chunks"]), max(chunk["end"] for chunk in index["chunks"])
+        fname = f"chunk_{start}_{end}_merged.npz"
+        np.savez(os.path.join(key_dir, fname), **columns)
+        for chunk in index["chunks"]:
+            os.remove(os.path.join(key_dir, chunk["file"]))
+        index["chunks"] = [{"file": fname, "start": start, "end": end, "bytes": os.path.getsize(os.path.join(key_dir, fname))}]
+        return index
+
+    def _load_chunk(self, key_dir, chunk):
+        with np.load(os.path.join(key_dir, chunk["file"])) as data:
+            return {name: data[name] for name in data.files}
+
+    def load(self, key, start_ms, end_ms):
+        """Returns the cached columns with start_ms <= date < end_ms."""
+        key_dir = self._key_dir(key)
+        if not os.path.isdir(key_dir):
+            return empty_columns()
+        with self._locked(key_dir):
+            index = self._read_index(key_dir)
+            chunks = [
+                clip_columns(self._load_chunk(key_dir, chunk), start_ms, end_ms)
+                for chunk in index["chunks"]
+                if chunk["start"] < end_ms and chunk["end"] > start_ms
+            ]
+            if index["intervals"]:
+                index["last_access"] = time.time()
+                self._write_index(key_dir, index)
+        return concat_columns(chunks) if chunks else empty_columns()
+
+    def evict(self):
+        """Removes least recently used keys until the cache fits in `max_bytes`."""
+        with self._lock:
+            usage = self._load_usage()
+            if self._total_bytes <= self.max_bytes:
+                return
+            for dirpath, (_, size) in sorted(usage.items(), key=lambda item: item[1][0]):
+                if self._total_bytes <= self.max_bytes:
+                    break
+                shutil.rmtree(dirpath, ignore_errors=True)
+                del usage[dirpath]
+                self._total_bytes -= size
@@ -0,0 +1,127 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from src.config import ALLOWED_SUFFIXES, MAX_QUERY_TIME_MS
+
+
+def _variable_metadata(collection):
+    """Returns the first/last dates and array length of every variable of a collection.
+
+    Names come from `distinct("name")` and each name costs two (name, date)
+    index lookups, so the collection is never scanned.
+    """
+    metadata = {}
+    for name in collection.distinct("name"):
+        if name is None:
+            continue
+        first = collection.find_one({"name": name}, {"date": 1, "values": 1, "array_len": 1}, sort=[("date", 1)], max_time_ms=MAX_QUERY_TIME_MS)
+        last = collection.find_one({"name": name}, {"date": 1}, sort=[("date", -1)], max_time_ms=MAX_QUERY_TIME_MS)
+        values = (first or {}).get("values")
+        sample = next(iter(values.values()), None) if isinstance(values, dict) else None
+        metadata[name] = {
+            "first": first["date"].isoformat() if first and first.get("date") else None,
+            "last": last["date"].isoformat() if last and last.get("date") else None,
+            "array_len": len(sample) if isinstance(sample, list) else (first or {}).get("array_len") or 0,
+        }
+    return metadata
+
+
+class VariableCatalog:
+    """TTL-cached index of the collections of one telescope DB and their variables.
+
+    Collection names are cheap to list and are refreshed synchronously once
+    stale. Variable lists, with first/last timestamps and array length per
+    variable (see `_variable_metadata`), are refreshed in a background
+    thread, and a plain `distinct("name")` is only used the very first time
+    a collection is seen. The catalog is persisted as
+    JSON when `path` is given, so restarts do not rescan.
+    """
+
+    def __init__(self, db, ttl, path=None):
+        self.db = db
+        self.ttl = ttl.total_seconds()
+        self.path = path
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._data = {"collections": [], "collections_ts": 0.0, "variables": {}}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._data, f)
+        os.replace(tmp_path, self.path)
+
+    def _is_stale(self, timestamp):
+        return time.time() - timestamp > self.ttl
+
+    def collections(self):
+        """Returns the collections that match the allowed resolution suffixes."""
+        if self._is_stale(self._data["collections_ts"]):
+            names = [col for col in self.db.list_collection_names() if any(col.endswith(suffix) for suffix in ALLOWED_SUFFIXES)]
+            with self._lock:
+                self._data["collections"] = names
+                self._data["collections_ts"] = time.time()
+                self._save()
+        return list(self._data["collections"])
+
+    def variables(self, collection_name):
+        """Returns the sorted variable names of a collection, refreshing in the background when stale."""
+        entry = self._data["variables"].get(collection_name)
+        if entry is None:
+            names = sorted(n for n in self.db[collection_name].distinct("name") if n is not None)
+            with self._lock:
+                self._data["variables"][collection_name] = {"names": names, "metadata": {}, "ts": 0.0}
+            self.refresh_async(collection_name)
+            return names
+        if self._is_stale(entry["ts"]):
+            self.refresh_async(collection_name)
+        return list(entry["names"])
+
+    def metadata(self, collection_name, var):
+        """Returns `{"first", "last", "array_len"}` for a variable, or None if not read yet."""
+        meta = self._data["variables"].get(collection_name, {}).get("metadata", {}).get(var)
+        if meta is None:
+            return None
+        return {
+            "first": datetime.fromisoformat(meta["first"]) if meta["first"] else None,
+            "last": datetime.fromisoformat(meta["last"]) if meta["last"] else None,
+            "array_len": meta["array_len"],
+        }
+
+    def refresh(self, collection_name):
+        """Re-reads a collection's variables and metadata and stores them."""
+        metadata = _variable_metadata(self.db[collection_name])
+        with self._lock:
+            self._data["variables"][collection_name] = {"names": sorted(metadata), "metadata": metadata, "ts": time.time()}
+            self._save()
+
+    def refresh_async(self, collection_name):
+        """Starts a background refresh of a collection unless one is already running."""
+        with self._lock:
+            if collection_name in self._refreshing:
+                return
+            self._refreshing.add(collection_name)
+
+        def run():
+            try:
+                self.refresh(collection_name)
+            except Exception:
+                # Keep serving the previous entry; the next stale read retries
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(collection_name)
+
+        threading.Thread(target=run, name=f"catalog-{collection_name}", daemon=True).start()
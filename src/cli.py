@@ -0,0 +1,108 @@
+"""Command-line extraction of CaCo variables to columnar files, without Streamlit.
+
+Usage:
+    python -m src.cli --telescope LST1 --collection camera_min --vars VAR [VAR ...] \\
+        --start 2025-01-01T18:00 --end 2025-01-02T08:00 [--format parquet] [--out exports]
+    python -m src.cli --telescope LST1 --collection camera_min --vars VAR [VAR ...] \\
+        --nights 2025-01-01 2025-01-31 [--night-hours 17 8] [--workers 8]
+
+One file is written per variable and time range (or night), and the files
+are extracted in parallel on a process pool.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+
+from src.config import TELESCOPES, DEFAULT_TELESCOPE, EXPORT_DIR, EXPORT_WINDOW, FETCH_MAX_WORKERS
+from src.database import get_db, get_range_cache
+from src.export import EXPORT_FORMATS, export_filename, iter_export_chunks, write_export
+from src.processor import night_ranges
+
+
+def output_path(out_dir, telescope, collection, var, start_dt, end_dt, fmt):
+    """Returns the file path of one (variable, range) extraction."""
+    return os.path.join(out_dir, export_filename(telescope, collection, [var], start_dt, end_dt, fmt))
+
+
+def extract(telescope, collection_name, var, start_dt, end_dt, fmt, path, use_cache=False):
+    """Streams one variable over [start_dt, end_dt] to `path`. Returns the number of rows written.
+
+    Runs in a worker process, which opens its own MongoDB client.
+    """
+    collection = get_db(telescope)[collection_name]
+    chunks = iter_export_chunks(
+        collection, [var], start_dt, end_dt, EXPORT_WINDOW,
+        cache=get_range_cache() if use_cache else None, telescope=telescope,
+    )
+    return write_export(chunks, path, fmt)
+
+
+def run_batch(jobs, workers=FETCH_MAX_WORKERS):
+    """Runs `extract` keyword-argument jobs on a process pool.
+
+    Yields `(job, n_rows, error)` as jobs finish, with `error` None on success.
+    A failed job (whatever the error) leaves no partial file behind and does
+    not stop the others.
+    """
+    # Spawned workers never inherit a MongoClient from the parent
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs))), mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(extract, **job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                n_rows = future.result()
+            except Exception as exc:
+                if os.path.exists(job["path"]):
+                    os.remove(job["path"])
+                yield job, 0, f"{type(exc).__name__}: {exc}"
+            else:
+                yield job, n_rows, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract CaCo variables to CSV, Parquet or NDJSON files.")
+    parser.add_argument("--telescope", default=DEFAULT_TELESCOPE, choices=list(TELESCOPES))
+    parser.add_argument("--collection", required=True, help="collection name including its resolution, e.g. camera_min")
+    parser.add_argument("--vars", nargs="+", required=True, metavar="VAR")
+    range_group = parser.add_mutually_exclusive_group(required=True)
+    range_group.add_argument("--start", type=datetime.fromisoformat, help="range start (UTC, ISO format); requires --end")
+    range_group.add_argument("--nights", nargs=2, type=date.fromisoformat, metavar=("FIRST", "LAST"), help="extract every night in this date range")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="range end (UTC, ISO format)")
+    parser.add_argument("--night-hours", nargs=2, type=int, default=[17, 8], metavar=("START", "END"))
+    parser.add_argument("--format", default="parquet", choices=list(EXPORT_FORMATS))
+    parser.add_argument("--out", default=EXPORT_DIR, help="output directory")
+    parser.add_argument("--workers", type=int, default=FETCH_MAX_WORKERS)
+    parser.add_argument("--use-cache", action="store_true", help="read ranges already in the local cache instead of querying them")
+    args = parser.parse_args(argv)
+
+    if args.start is not None:
+        if args.end is None:
+            parser.error("--start requires --end")
+        ranges = [(args.start, args.end)]
+    else:
+        ranges = night_ranges(*args.nights, *args.night_hours)
+
+    jobs = [
+        {
+            "telescope": args.telescope, "collection_name": args.collection, "var": var,
+            "start_dt": start_dt, "end_dt": end_dt, "fmt": args.format, "use_cache": args.use_cache,
+            "path": output_path(args.out, args.telescope, args.collection, var, start_dt, end_dt, args.format),
+        }
+        for start_dt, end_dt in ranges for var in args.vars
+    ]
+
+    n_failed = 0
+    for job, n_rows, error in run_batch(jobs, args.workers):
+        if error:
+            n_failed += 1
+            print(f"FAILED {job['var']} {job['start_dt']:%Y-%m-%d %H:%M}: {error}", file=sys.stderr)
+        else:
+            print(f"{n_rows:>10,} rows  {job['path']}")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
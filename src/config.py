@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import os 
 
 # Database port of client + name
@@ -31,6 +31,23 @@ TELESCOPES = {
 
 DEFAULT_TELESCOPE = "LST1"
 
+# MongoDB client options for every telescope; a TELESCOPES entry can override
+# them with its own "client_options" dict. Compressors whose Python package is
+# not installed are skipped. A short server selection timeout keeps a down
+# telescope from stalling the page.
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 20,
+    "minPoolSize": 1,
+    "compressors": ["zstd", "snappy", "zlib"],
+    "readPreference": "secondaryPreferred",
+    "serverSelectionTimeoutMS": 2000,
+    "connectTimeoutMS": 2000,
+    "appname": "caco-query-engine",
+}
+
+# Every telescope DB is pinged this often (seconds) in the background.
+HEALTH_PROBE_INTERVAL_S = 10
+
 # Assets
 current_dir = os.path.dirname(os.path.abspath(__file__))
 repo_root = os.path.dirname(current_dir) 
@@ -58,8 +75,113 @@ FSM_VARS = ["CACO_CameraControl_FSM_previous_state", "CACO_CameraControl_FSM_sta
 
 ALLOWED_SUFFIXES = ["_min", "_hour", "_day", "_week"]
 
+# Approximate spacing (seconds) between expanded samples in each resolution.
+# Used to estimate how many points a query returns.
+SAMPLE_PERIOD_S = {"_min": 1, "_hour": 60, "_day": 3600, "_week": 86400}
+
+# Time (seconds) covered by the `values` of one document in each resolution.
+DOC_SPAN_S = {"_min": 60, "_hour": 3600, "_day": 86400, "_week": 604800}
+
+# "auto" resolution picks the finest collection whose estimated number of
+# points over all selected variables stays below this budget.
+AUTO_POINT_BUDGET = 200_000
+
 # Safety limits
 SAFE_QUERY_LIMIT = 100000
 
+# Queries estimated (from DOC_SPAN_S and the catalog) below this fraction of
+# SAFE_QUERY_LIMIT skip the DB count entirely.
+COUNT_SKIP_FRACTION = 0.5
+
 # Query execution timeframe (milliseconds). 30 seconds default.
 MAX_QUERY_TIME_MS = 60_000
+
+# Approximate plot width in pixels. Server-side downsampling returns one bin
+# per pixel so the transferred size does not depend on the time range.
+PLOT_WIDTH_PX = 1600
+
+# Series with more points than this are drawn as lines without markers.
+DENSE_MARKER_THRESHOLD = 2000
+
+# Array variables (camera pixels/modules): number of most deviating elements
+# drawn individually, and cell budget of the time x element heatmap.
+ARRAY_WORST_N = 5
+HEATMAP_MAX_CELLS = 400_000
+
+# In "auto" fetch mode, ranges at least this long are downsampled server-side.
+DOWNSAMPLE_MIN_RANGE = timedelta(days=2)
+
+# Percentiles of the "summary" fetch mode (approximate, computed by MongoDB >= 7.0).
+SUMMARY_PERCENTILES = [0.05, 0.5, 0.95]
+
+# Out-of-range interval search: samples closer than this (on top of the
+# sampling period) join the same interval, at most this many intervals are
+# returned, and zooming to an interval adds this margin on each side.
+SEARCH_MERGE_GAP = timedelta(minutes=1)
+SEARCH_MAX_INTERVALS = 1000
+SEARCH_ZOOM_MARGIN = timedelta(minutes=10)
+
+# Documents per cursor batch when streaming query results.
+FETCH_BATCH_SIZE = 2000
+
+# Variables are fetched in parallel, one query per variable, on this many threads.
+FETCH_MAX_WORKERS = 8
+
+# In telescope comparison mode, each telescope gets this long (seconds) to answer.
+COMPARE_TIMEOUT_S = 20
+
+# While streaming, redraw the partial plot at most this often (seconds).
+PARTIAL_RENDER_INTERVAL_S = 2.0
+
+# Local on-disk cache of fetched data (per telescope, collection and variable)
+CACHE_DIR = os.environ.get("CACO_CACHE_DIR", os.path.join(repo_root, ".cache", "ranges"))
+CACHE_MAX_BYTES = 2 * 1024**3
+
+# Data newer than this may still be written by CaCo, so it is never cached.
+CACHE_SETTLE_TIME = timedelta(minutes=15)
+
+# In-memory cache of query results shared by all sessions. Results of
+# ranges that end before CACHE_SETTLE_TIME are kept until evicted, the
+# others expire after RESULT_CACHE_TTL_S.
+RESULT_CACHE_MAX_BYTES = 1024**3
+RESULT_CACHE_TTL_S = 60
+
+# Variable catalog (collections -> variable names and metadata) refresh period
+CATALOG_TTL = timedelta(hours=1)
+CATALOG_DIR = os.environ.get("CACO_CATALOG_DIR", os.path.join(repo_root, ".cache", "catalog"))
+
+# Exports are written here, streaming one window of one variable at a time.
+EXPORT_DIR = os.environ.get("CACO_EXPORT_DIR", os.path.join(repo_root, "exports"))
+EXPORT_WINDOW = timedelta(days=1)
+
+# Export formats and their file extensions.
+EXPORT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "ndjson.gz": ".ndjson.gz"}
+
+# Larger export files are left on the server instead of offered for download.
+EXPORT_DOWNLOAD_MAX_BYTES = 500 * 1024**2
+
+# Live mode: refresh period (seconds), samples kept per variable (one day at
+# 1 Hz) and time limit of each incremental poll query (milliseconds).
+LIVE_REFRESH_S = 10
+LIVE_BUFFER_SIZE = 86_400
+LIVE_POLL_TIME_MS = 5_000
+
+# Rollups (_hour/_day/_week built from _min): watermarks are stored in this
+# collection, minutes newer than the settle time are left for the next run,
+# and each aggregation covers at most this many target buckets.
+ROLLUP_STATE_COLLECTION = "rollup_state"
+ROLLUP_SETTLE_TIME = timedelta(minutes=15)
+ROLLUP_STEP_BUCKETS = 24
+
+# Multi-night view: most nights fetched at once, and number of bins the
+# folded "hours since night start" axis is split into.
+MAX_NIGHTS = 60
+NIGHT_FOLD_BINS = 300
+
+# Correlation view: pairs are drawn one by one up to this many, and as an
+# N x N density histogram above it.
+CORRELATION_SCATTER_MAX = 5000
+CORRELATION_BINS = 120
+
+# Rows per page of the raw data table.
+TABLE_PAGE_SIZE = 100
@@ -0,0 +1,205 @@
+import threading
+from collections import deque
+from time import monotonic, sleep
+
+import numpy as np
+import pymongo
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+from src.config import MONGO_CLIENT_OPTIONS, HEALTH_PROBE_INTERVAL_S
+
+# Python package each wire compressor needs (zlib is in the standard library)
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+class TelescopeUnavailable(Exception):
+    """Raised when the last health probe found a telescope DB unreachable."""
+
+
+def available_compressors(preferred):
+    """Returns the compressors of `preferred` whose Python package is installed, in order."""
+    available = []
+    for name in preferred:
+        try:
+            __import__(COMPRESSOR_MODULES[name])
+        except (ImportError, KeyError):
+            continue
+        available.append(name)
+    return available
+
+
+class ClientMetrics(monitoring.CommandListener, monitoring.ConnectionPoolListener):
+    """Counts commands, their latency and pool connections of one client (pymongo event listener)."""
+
+    def __init__(self, n_latencies=500):
+        self._lock = threading.Lock()
+        self.commands = 0
+        self.n_failed = 0
+        self.latencies_ms = deque(maxlen=n_latencies)
+        self.open_connections = 0
+        self.in_use = 0
+        self.checkout_failures = 0
+
+    # Commands
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        with self._lock:
+            self.commands += 1
+            self.latencies_ms.append(event.duration_micros / 1000)
+
+    def failed(self, event):
+        with self._lock:
+            self.commands += 1
+            self.n_failed += 1
+            self.latencies_ms.append(event.duration_micros / 1000)
+
+    # Connection pool
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.in_use += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def snapshot(self):
+        """Returns the current counters and the p50/p95 command latency in ms."""
+        with self._lock:
+            latencies = np.array(self.latencies_ms)
+            return {
+                "commands": self.commands,
+                "failed": self.n_failed,
+                "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "checkout_failures": self.checkout_failures,
+            }
+
+
+class ConnectionManager:
+    """One pooled MongoClient per telescope, with a background health probe.
+
+    Client options are `MONGO_CLIENT_OPTIONS`, overridden by the optional
+    `client_options` of each `TELESCOPES` entry. A daemon thread pings every
+    telescope every `probe_interval` seconds; `client()` raises
+    `TelescopeUnavailable` right away for a telescope whose last probe
+    failed, instead of waiting for server selection to time out.
+    """
+
+    def __init__(self, telescopes, probe_interval=HEALTH_PROBE_INTERVAL_S):
+        self.telescopes = telescopes
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._metrics = {}
+        self._health = {}
+        self._probe_thread = None
+
+    def _client_options(self, telescope):
+        options = {**MONGO_CLIENT_OPTIONS, **self.telescopes[telescope].get("client_options", {})}
+        compressors = available_compressors(options.pop("compressors", []))
+        if compressors:
+            options["compressors"] = ",".join(compressors)
+        return options
+
+    def _get_client(self, telescope):
+        with self._lock:
+            if telescope not in self._clients:
+                metrics = ClientMetrics()
+                self._clients[telescope] = pymongo.MongoClient(
+                    self.telescopes[telescope]["uri"], event_listeners=[metrics], **self._client_options(telescope)
+                )
+                self._metrics[telescope] = metrics
+            return self._clients[telescope]
+
+    def client(self, telescope):
+        """Returns the telescope's client, failing fast if its last probe found it down."""
+        self.start_probing()
+        health = self._health.get(telescope)
+        if health and not health["reachable"]:
+            raise TelescopeUnavailable(
+                f"{telescope} DB is unreachable (last checked {monotonic() - health['checked']:.0f}s ago: {health['error']})"
+            )
+        return self._get_client(telescope)
+
+    def probe(self, telescope):
+        """Pings one telescope, records and returns its health."""
+        start = monotonic()
+        try:
+            self._get_client(telescope).admin.command("ping")
+            health = {"reachable": True, "latency_ms": (monotonic() - start) * 1000, "error": None}
+        except PyMongoError as exc:
+            # Keep the first line of the error, without the timeout/topology details
+            error = str(exc).split(" (configured timeouts")[0].split(", Timeout:")[0]
+            health = {"reachable": False, "latency_ms": None, "error": error}
+        health["checked"] = monotonic()
+        self._health[telescope] = health
+        return health
+
+    def start_probing(self):
+        """Starts the background probe thread once."""
+        with self._lock:
+            if self._probe_thread is not None:
+                return
+            self._probe_thread = threading.Thread(target=self._probe_loop, name="mongo-health", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while True:
+            for telescope in self.telescopes:
+                self.probe(telescope)
+            sleep(self.probe_interval)
+
+    def is_reachable(self, telescope):
+        """Returns the cached reachability of a telescope, or None if it was not probed yet."""
+        health = self._health.get(telescope)
+        return health["reachable"] if health else None
+
+    def status(self):
+        """Returns one row per telescope with its cached health and client metrics."""
+        rows = []
+        for telescope in self.telescopes:
+            health = self._health.get(telescope, {})
+            metrics = self._metrics.get(telescope)
+            rows.append({
+                "telescope": telescope,
+                "reachable": health.get("reachable"),
+                "ping_ms": health.get("latency_ms"),
+                "error": health.get("error"),
+                **(metrics.snapshot() if metrics else {}),
+            })
+        return rows
@@ -1,21 +1,65 @@
-import pymongo
-import streamlit as st
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from time import monotonic
+
+import numpy as np
 from pymongo.errors import ExecutionTimeout
-from src.config import ALLOWED_SUFFIXES, SAFE_QUERY_LIMIT, MAX_QUERY_TIME_MS, TELESCOPES, DEFAULT_TELESCOPE
+from src.config import (
+    ALLOWED_SUFFIXES, SAFE_QUERY_LIMIT, MAX_QUERY_TIME_MS, TELESCOPES, DEFAULT_TELESCOPE, SAMPLE_PERIOD_S,
+    FETCH_BATCH_SIZE, DOC_SPAN_S, CACHE_DIR, CACHE_MAX_BYTES, CACHE_SETTLE_TIME,
+    CATALOG_TTL, CATALOG_DIR, FETCH_MAX_WORKERS, COMPARE_TIMEOUT_S,
+    COUNT_SKIP_FRACTION, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL_S,
+)
+from src.cache import RangeCache, clip_columns, from_ms, to_ms
+from src.catalog import VariableCatalog
+from src.connection import ConnectionManager, TelescopeUnavailable
+from src.processor import concat_columns, expand_values_columnar
+from src.result_cache import ResultCache
+
+# Fields dropped from fetched documents; they are never displayed or exported
+FETCH_PROJECTION = {"_id": 0, "hierarchical_name": 0}
+
+
+class QueryTooLarge(Exception):
+    """Raised when a query matches more than `SAFE_QUERY_LIMIT` documents and was not confirmed."""
+
+    def __init__(self, count, estimate=None):
+        self.count = count
+        self.estimate = estimate
+        size_hint = f"about {estimate:,}" if estimate else f"more than {SAFE_QUERY_LIMIT:,}"
+        super().__init__(f"This query will return {size_hint} documents.")
+
+
+class QueryTimeout(Exception):
+    """Raised when a query runs longer than its `maxTimeMS` on the server.
+
+    `data_by_var` holds whatever was fetched before the timeout, if anything.
+    """
+
+    def __init__(self, message, data_by_var=None):
+        self.data_by_var = data_by_var or {}
+        super().__init__(message)
 
-@st.cache_resource
-def _get_mongo_client(uri):
-    """Create and cache MongoDB client for a specific URI."""
-    return pymongo.MongoClient(uri)
+
+@lru_cache(maxsize=None)
+def get_connections():
+    """Create and cache the connection manager holding one client per telescope."""
+    return ConnectionManager(TELESCOPES)
 
 
 def get_db(telescope=DEFAULT_TELESCOPE):
-    """Get database connection for the specified telescope."""
+    """Get database connection for the specified telescope.
+
+    Raises `TelescopeUnavailable` at once if the telescope's last health
+    probe failed.
+    """
     if telescope not in TELESCOPES:
         telescope = DEFAULT_TELESCOPE
     
     telescope_config = TELESCOPES[telescope]
-    client = _get_mongo_client(telescope_config["uri"])
+    client = get_connections().client(telescope)
     return client[telescope_config["db_name"]]
 
 def get_mongo_connection_info(telescope=DEFAULT_TELESCOPE):
@@ -30,42 +74,428 @@ def get_mongo_connection_info(telescope=DEFAULT_TELESCOPE):
         return mongo_host.split(":")
     return mongo_host, str(telescope_config["port"])
 
+@lru_cache(maxsize=None)
+def get_catalog(telescope=DEFAULT_TELESCOPE):
+    """Create and cache the variable catalog of a telescope DB, persisted under `CATALOG_DIR`."""
+    if telescope not in TELESCOPES:
+        telescope = DEFAULT_TELESCOPE
+    return VariableCatalog(get_db(telescope), CATALOG_TTL, os.path.join(CATALOG_DIR, f"{telescope}.json"))
+
 def get_filtered_collections(db):
     """Returns collections that match the allowed resolution suffixes."""
     all_collections = list(db.list_collection_names())
     return [col for col in all_collections if any(col.endswith(suffix) for suffix in ALLOWED_SUFFIXES)]
 
-def fetch_data(collection, selected_vars, start_dt, end_dt):
-    """Executes the query and returns the sorted data.
+def estimate_points(suffix, start_dt, end_dt, n_vars=1):
+    """Estimates the number of expanded samples a query on `suffix` returns."""
+    seconds = max(0.0, (end_dt - start_dt).total_seconds())
+    return int(n_vars * seconds / SAMPLE_PERIOD_S[suffix])
+
+def choose_resolution(base, collections, start_dt, end_dt, n_vars, budget):
+    """Returns the finest existing `{base}{suffix}` collection that fits the point budget.
 
-    Safety check: first do a fast `count_documents` and, if the result
-    exceeds `SAFE_QUERY_LIMIT`, warn the user and require explicit
-    confirmation via a Streamlit button before running the full query.
+    Falls back to the coarsest existing collection when none fits.
     """
-    query = {"name": {"$in": selected_vars}, "date": {"$gte": start_dt, "$lte": end_dt}}
+    candidates = [suffix for suffix in ALLOWED_SUFFIXES if f"{base}{suffix}" in collections]
+    for suffix in candidates:
+        if estimate_points(suffix, start_dt, end_dt, n_vars) <= budget:
+            return f"{base}{suffix}"
+    return f"{base}{candidates[-1]}" if candidates else None
 
-    # Fast count check with timeout
-    try:
-        count = collection.count_documents(query, maxTimeMS=MAX_QUERY_TIME_MS)
-    except ExecutionTimeout:
-        st.error("Query timed out while counting results. Please narrow your filters.")
-        st.stop()
-    except Exception:
-        # If count fails for any other reason, fall back to running the query
-        count = 0
+def build_query(selected_vars, start_dt, end_dt):
+    """Returns the find filter for the selected variables and date range."""
+    return {"name": {"$in": list(selected_vars)}, "date": {"$gte": start_dt, "$lte": end_dt}}
+
+def doc_span(collection):
+    """Returns the time covered by one document of the collection, from its resolution suffix."""
+    suffix = "_" + collection.name.rsplit("_", 1)[-1]
+    return timedelta(seconds=DOC_SPAN_S.get(suffix, 0))
+
+def estimate_documents(collection, var_ranges, catalog=None):
+    """Estimates how many documents a query returns without touching the DB.
+
+    `var_ranges` holds `(var, start_dt, end_dt)` tuples. Each resolution
+    writes one document per `DOC_SPAN_S` per variable, and each range is
+    first clipped to the variable's first timestamp when the catalog knows
+    it. The catalog's last timestamp is not used: it goes stale when its
+    refresh fails, and an estimate near 0 would skip the size guard.
+    Returns None for collections with an unknown resolution.
+    """
+    span_s = doc_span(collection).total_seconds()
+    if not span_s:
+        return None
+
+    total = 0
+    for var, start_dt, end_dt in var_ranges:
+        meta = catalog.metadata(collection.name, var) if catalog else None
+        if meta and meta["first"]:
+            start_dt = max(start_dt, meta["first"])
+        if end_dt >= start_dt:
+            total += int((end_dt - start_dt).total_seconds() // span_s) + 1
+    return total
+
+def check_query_size(collection, query, estimate=None, confirmed=False, known_counts=None):
+    """Guards against huge queries without scanning the whole result first.
+
+    If the `estimate_documents` estimate is well below `SAFE_QUERY_LIMIT`
+    the DB is not asked at all. Otherwise a count bounded at
+    `SAFE_QUERY_LIMIT + 1` (which stops scanning there) decides, and a
+    query above the limit raises `QueryTooLarge` unless `confirmed`.
+    Counts are remembered in `known_counts` (keyed by query) when given, so
+    a confirmed retry does not count again. Returns the expected number of
+    documents for progress reporting (0 if unknown).
+    """
+    if estimate is not None and estimate <= SAFE_QUERY_LIMIT * COUNT_SKIP_FRACTION:
+        return estimate
+
+    known_counts = {} if known_counts is None else known_counts
+    query_key = repr(query)
+    if query_key in known_counts:
+        count = known_counts[query_key]
+    else:
+        # Bounded count check with timeout
+        try:
+            count = collection.count_documents(query, limit=SAFE_QUERY_LIMIT + 1, maxTimeMS=MAX_QUERY_TIME_MS)
+        except ExecutionTimeout as exc:
+            raise QueryTimeout("Query timed out while counting results. Please narrow your filters.") from exc
+        except Exception:
+            # If count fails for any other reason, fall back to running the query
+            count = 0
+        known_counts[query_key] = count
 
     if count > SAFE_QUERY_LIMIT:
-        st.warning(f"(!) This query will return {count:,} documents.")
-        st.info("Large queries can slow down the cluster. Are you sure you need all this data?")
+        if not confirmed:
+            raise QueryTooLarge(count, estimate)
+        known_counts.pop(query_key, None)
+        return estimate or count
+
+    return count
+
+def iter_batches(collection, selected_vars, start_dt, end_dt, batch_size=FETCH_BATCH_SIZE, max_time_ms=MAX_QUERY_TIME_MS):
+    """Yields the matching documents in date order, `batch_size` at a time.
+
+    Documents are projected without `_id` and `hierarchical_name` and read
+    from a cursor with the same batch size, so only one batch is held in
+    memory at a time. Raises `QueryTimeout` if the query runs longer
+    than `max_time_ms`.
+    """
+    query = build_query(selected_vars, start_dt, end_dt)
+    cursor = collection.find(query, FETCH_PROJECTION, max_time_ms=max_time_ms, batch_size=batch_size).sort("date", 1)
+
+    batch = []
+    try:
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except ExecutionTimeout as exc:
+        raise QueryTimeout(f"Query exceeded maximum execution time ({max_time_ms // 1000}s). Please narrow your filters.") from exc
+    finally:
+        cursor.close()
+
+    if batch:
+        yield batch
+
+def fetch_data(collection, selected_vars, start_dt, end_dt, confirmed=False):
+    """Executes the query (after the size check) and returns the sorted data."""
+    estimate = estimate_documents(collection, [(var, start_dt, end_dt) for var in selected_vars])
+    check_query_size(collection, build_query(selected_vars, start_dt, end_dt), estimate, confirmed)
+    return [doc for batch in iter_batches(collection, selected_vars, start_dt, end_dt) for doc in batch]
+
+@lru_cache(maxsize=None)
+def get_range_cache():
+    """Create and cache the on-disk range cache shared by all sessions."""
+    return RangeCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+@lru_cache(maxsize=None)
+def get_result_cache():
+    """Create and cache the in-memory result cache shared by all sessions."""
+    return ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL_S)
 
-        # Require user confirmation to proceed. On first run this will render
-        # the button and then call `st.stop()` to avoid executing the heavy query.
-        if not st.button("Download anyway"):
-            st.stop()
+def _fetch_var_gaps(collection, var, gaps, span, n_docs, max_time_ms=MAX_QUERY_TIME_MS, progress_key=None):
+    """Fetches the [start, end) ms gaps of one variable with one query per gap.
 
-    # If safe or confirmed, execute the query with a maximum execution time
+    Runs in a worker thread; the number of documents read so far is
+    published in `n_docs[progress_key]` (default: `var`). Returns
+    `(gap_start, gap_end, columns)` tuples.
+    """
+    progress_key = var if progress_key is None else progress_key
+    results = []
+    for gap_start, gap_end in gaps:
+        chunks = []
+        for batch in iter_batches(collection, [var], from_ms(gap_start) - span, from_ms(gap_end), max_time_ms=max_time_ms):
+            chunks.append(expand_values_columnar(batch))
+            n_docs[progress_key] += len(batch)
+        results.append((gap_start, gap_end, clip_columns(concat_columns(chunks), gap_start, gap_end)))
+    return results
+
+def fetch_columns(collection, telescope, selected_vars, start_dt, end_dt, on_progress=None, confirmed=False, known_counts=None, cache=None):
+    """Returns columns per variable for samples in [start_dt, end_dt], through `cache` if given.
+
+    See `fetch_ranges`, which this calls with a single range.
+    """
+    return fetch_ranges(collection, telescope, selected_vars, [(start_dt, end_dt)], on_progress, confirmed, known_counts, cache)
+
+def _missing(cache, key, start_ms, end_ms):
+    """Returns the gaps of [start_ms, end_ms) not in `cache` (the whole range without a cache)."""
+    return cache.missing(key, start_ms, end_ms) if cache is not None else [(start_ms, end_ms)]
+
+def _plan_gaps(collection, telescope, selected_vars, bounds, confirmed=False, known_counts=None, cache=None):
+    """Returns the uncached ms gaps of each variable within `bounds` and their expected document count.
+
+    Runs the usual size check on the gaps (see `check_query_size`), so it
+    raises `QueryTooLarge` before anything is fetched.
+    """
+    span = doc_span(collection)
+    gaps = {
+        var: [gap for start_ms, end_ms in bounds for gap in _missing(cache, (telescope, collection.name, var), start_ms, end_ms)]
+        for var in selected_vars
+    }
+    gap_filters = [
+        {"name": var, "date": {"$gte": from_ms(gap_start) - span, "$lte": from_ms(gap_end)}}
+        for var, var_gaps in gaps.items() for gap_start, gap_end in var_gaps
+    ]
+    estimate = estimate_documents(
+        collection,
+        [(var, from_ms(gap_start), from_ms(gap_end)) for var, var_gaps in gaps.items() for gap_start, gap_end in var_gaps],
+        get_catalog(telescope),
+    )
+    count = check_query_size(collection, {"$or": gap_filters}, estimate, confirmed, known_counts) if gap_filters else 0
+    return gaps, count
+
+def fetch_ranges(collection, telescope, selected_vars, ranges, on_progress=None, confirmed=False, known_counts=None, cache=None):
+    """Returns columns per variable for samples in any of the [start_dt, end_dt] `ranges`.
+
+    With a range `cache`, only the time gaps of each variable that are not
+    cached yet are queried, and fetched gaps are written back to it, except
+    for the last `CACHE_SETTLE_TIME`, which CaCo may still be filling.
+    Queries run after the usual size check, one per gap on a pool of
+    `FETCH_MAX_WORKERS` threads, so many variables or many ranges (e.g.
+    nights) are fetched concurrently. `on_progress(n_docs, count)` is
+    called from the calling thread while the workers run. Raises
+    `QueryTooLarge` (see `check_query_size`), or `QueryTimeout` carrying
+    the variables that did answer.
+    """
+    bounds = [(to_ms(start_dt), to_ms(end_dt) + 1) for start_dt, end_dt in ranges]
+    settled_ms = to_ms(datetime.now(timezone.utc).replace(tzinfo=None) - CACHE_SETTLE_TIME)
+    span = doc_span(collection)
+    gaps, count = _plan_gaps(collection, telescope, selected_vars, bounds, confirmed, known_counts, cache)
+
+    fetched, timed_out = {var: [] for var in selected_vars}, set()
+    tasks = [(var, gap) for var in selected_vars for gap in gaps[var]]
+    if tasks:
+        n_docs = {i: 0 for i in range(len(tasks))}
+        with ThreadPoolExecutor(max_workers=min(FETCH_MAX_WORKERS, len(tasks))) as pool:
+            futures = {
+                pool.submit(_fetch_var_gaps, collection, var, [gap], span, n_docs, progress_key=i): var
+                for i, (var, gap) in enumerate(tasks)
+            }
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=0.25)
+                if on_progress:
+                    on_progress(sum(n_docs.values()), count)
+
+        for future, var in futures.items():
+            try:
+                fetched[var].extend(future.result())
+            except QueryTimeout:
+                timed_out.add(var)
+
+    data_by_var = {
+        var: _store_and_load(cache, (telescope, collection.name, var), fetched[var], bounds, settled_ms)
+        for var in selected_vars
+    }
+    if timed_out:
+        raise QueryTimeout(
+            f"Query for {', '.join(repr(var) for var in selected_vars if var in timed_out)} exceeded maximum execution time ({MAX_QUERY_TIME_MS // 1000}s). Please narrow your filters.",
+            data_by_var,
+        )
+    return data_by_var
+
+def _store_and_load(cache, key, fetched, bounds, settled_ms):
+    """Writes the settled part of freshly fetched gaps to the cache and returns the full `bounds` ranges."""
+    if cache is None:
+        return concat_columns([columns for _, _, columns in fetched])
+    fresh = []
+    for gap_start, gap_end, columns in fetched:
+        split = min(max(gap_start, settled_ms), gap_end)
+        if split > gap_start:
+            cache.store(key, gap_start, split, columns)
+        fresh.append(clip_columns(columns, split, gap_end))
+    return concat_columns([cache.load(key, start_ms, end_ms) for start_ms, end_ms in bounds] + fresh)
+
+def _fetch_telescope(cache, collection, telescope, selected_vars, gaps, bounds, max_time_ms):
+    """Fetches the planned `gaps` of all variables of one telescope (worker thread, no Streamlit calls)."""
+    settled_ms = to_ms(datetime.now(timezone.utc).replace(tzinfo=None) - CACHE_SETTLE_TIME)
+    span = doc_span(collection)
+    n_docs = {var: 0 for var in selected_vars}
+
+    data_by_var = {}
+    for var in selected_vars:
+        key = (telescope, collection.name, var)
+        fetched = _fetch_var_gaps(collection, var, gaps[var], span, n_docs, max_time_ms)
+        data_by_var[var] = _store_and_load(cache, key, fetched, bounds, settled_ms)
+    return data_by_var
+
+def _finished(futures, deadline, timeout_s, errors):
+    """Waits for per-telescope `futures` until `deadline`; records the ones still running in `errors` and returns the others."""
+    _, not_done = wait(futures.values(), timeout=max(0.0, deadline - monotonic()))
+    for telescope, future in futures.items():
+        if future in not_done:
+            errors[telescope] = f"no answer within {timeout_s:.0f}s"
+    return {telescope: future for telescope, future in futures.items() if future not in not_done}
+
+def fetch_telescopes(telescopes, collection_name, selected_vars, start_dt, end_dt, n_bins=None, confirmed=False, known_counts=None, cache=None, timeout_s=COMPARE_TIMEOUT_S):
+    """Fetches the same variables and range from several telescopes concurrently.
+
+    Each telescope runs in its own thread on its own cached client, and its
+    queries are capped at `timeout_s` on the server. Telescopes that have not
+    answered after `timeout_s` are reported as timed out and left behind, so
+    a slow or unreachable DB never blocks the others. Telescopes whose last
+    health probe failed are skipped without a query. With `n_bins`, each
+    telescope is downsampled on the server (see `fetch_downsampled`).
+    Otherwise every telescope gets the usual size check first, and if any
+    is too large `QueryTooLarge` is raised for their total before anything
+    is fetched; data then goes through the range `cache`, if given.
+    Returns `(data_by_telescope, errors)`, with `errors` mapping telescope
+    to a message.
+    """
+    collections, errors = {}, {}
+    for telescope in telescopes:
+        try:
+            collections[telescope] = get_db(telescope)[collection_name]
+        except TelescopeUnavailable as exc:
+            errors[telescope] = str(exc)
+
+    data_by_telescope = {}
+    if not collections:
+        return data_by_telescope, errors
+    bounds = [(to_ms(start_dt), to_ms(end_dt) + 1)]
+    # Counts are kept per telescope, the same query matches different data on each DB
+    known_counts = {} if known_counts is None else known_counts
+    deadline = monotonic() + timeout_s
+    pool = ThreadPoolExecutor(max_workers=len(collections))
+    try:
+        if n_bins:
+            futures = {
+                telescope: pool.submit(fetch_downsampled, collection, selected_vars, start_dt, end_dt, n_bins)
+                for telescope, collection in collections.items()
+            }
+        else:
+            plans = _finished({
+                telescope: pool.submit(
+                    _plan_gaps, collection, telescope, selected_vars, bounds, confirmed,
+                    known_counts.setdefault(telescope, {}), cache,
+                )
+                for telescope, collection in collections.items()
+            }, deadline, timeout_s, errors)
+            too_large = [future.exception() for future in plans.values() if isinstance(future.exception(), QueryTooLarge)]
+            if too_large:
+                estimates = [exc.estimate for exc in too_large]
+                raise QueryTooLarge(sum(exc.count for exc in too_large), sum(estimates) if all(estimates) else None)
+
+            futures = {}
+            for telescope, future in plans.items():
+                if future.exception() is not None:
+                    errors[telescope] = str(future.exception())
+                    continue
+                gaps, _ = future.result()
+                futures[telescope] = pool.submit(
+                    _fetch_telescope, cache, collections[telescope], telescope, selected_vars, gaps, bounds, int(timeout_s * 1000),
+                )
+
+        for telescope, future in _finished(futures, deadline, timeout_s, errors).items():
+            if future.exception() is not None:
+                errors[telescope] = str(future.exception())
+            else:
+                data_by_telescope[telescope] = future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return data_by_telescope, errors
+
+def sample_stages():
+    """Aggregation stages that turn each document into one row per sample.
+
+    Every `values` entry becomes a row `{name, t, avg, min, max, array_len}`
+    dated at the document date plus its second offset, with array samples
+    reduced to their mean. Documents without `values` contribute one row
+    from their own avg/min/max.
+    """
+    has_values = {"$eq": [{"$type": "$values"}, "object"]}
+    sample_mean = {"$avg": "$sample.v"}
+    return [
+        {"$project": {
+            "name": 1, "date": 1, "avg": 1, "min": 1, "max": 1, "array_len": 1,
+            "has_values": has_values,
+            "sample": {"$cond": [has_values, {"$objectToArray": "$values"}, [{"k": "0", "v": None}]]},
+        }},
+        {"$unwind": "$sample"},
+        {"$project": {
+            "name": 1,
+            "t": {"$add": ["$date", {"$multiply": [
+                {"$convert": {"input": "$sample.k", "to": "long", "onError": None, "onNull": None}}, 1000,
+            ]}]},
+            "avg": {"$cond": ["$has_values", sample_mean, "$avg"]},
+            "min": {"$cond": ["$has_values", sample_mean, {"$ifNull": ["$min", "$avg"]}]},
+            "max": {"$cond": ["$has_values", sample_mean, {"$ifNull": ["$max", "$avg"]}]},
+            "array_len": {"$cond": [{"$isArray": "$sample.v"}, {"$size": "$sample.v"}, {"$ifNull": ["$array_len", 0]}]},
+        }},
+    ]
+
+def build_downsample_pipeline(selected_vars, start_dt, end_dt, n_bins):
+    """Builds the aggregation that reduces each variable to `n_bins` time bins.
+
+    Samples (see `sample_stages`) are grouped per (variable, bin) into
+    mean/min/max. Returns the pipeline and the bin width in milliseconds.
+    """
+    span_ms = max(1, int((end_dt - start_dt).total_seconds() * 1000))
+    width_ms = max(1, -(-span_ms // max(1, int(n_bins))))
+
+    pipeline = [
+        {"$match": build_query(selected_vars, start_dt, end_dt)},
+        *sample_stages(),
+        {"$match": {"t": {"$gte": start_dt, "$lte": end_dt}}},
+        {"$group": {
+            "_id": {"name": "$name", "bin": {"$floor": {"$divide": [{"$subtract": ["$t", start_dt]}, width_ms]}}},
+            "avg": {"$avg": "$avg"},
+            "min": {"$min": "$min"},
+            "max": {"$max": "$max"},
+            "array_len": {"$max": "$array_len"},
+        }},
+        {"$sort": {"_id.name": 1, "_id.bin": 1}},
+    ]
+    return pipeline, width_ms
+
+def fetch_downsampled(collection, selected_vars, start_dt, end_dt, n_bins):
+    """Runs the downsampling aggregation and returns columns per variable.
+
+    The output has the same layout as `process_data_by_var`, with one row per
+    non-empty bin dated at the bin start, so transfer size is bounded by
+    `len(selected_vars) * n_bins` whatever the time range. Raises
+    `QueryTimeout` if the aggregation runs longer than `MAX_QUERY_TIME_MS`.
+    """
+    pipeline, width_ms = build_downsample_pipeline(selected_vars, start_dt, end_dt, n_bins)
     try:
-        return list(collection.find(query, max_time_ms=MAX_QUERY_TIME_MS).sort("date", 1))
-    except ExecutionTimeout:
-        st.error("Query exceeded maximum execution time (60s). Please narrow your filters.")
-        return []
\ No newline at end of file
+        rows = list(collection.aggregate(pipeline, maxTimeMS=MAX_QUERY_TIME_MS, allowDiskUse=True))
+    except ExecutionTimeout as exc:
+        raise QueryTimeout("Downsampling query exceeded maximum execution time. Please narrow your filters.") from exc
+
+    rows_by_var = {var: [] for var in selected_vars}
+    for row in rows:
+        if row["_id"]["name"] in rows_by_var:
+            rows_by_var[row["_id"]["name"]].append(row)
+
+    start = np.datetime64(start_dt, "ms")
+    data_by_var = {}
+    for var, var_rows in rows_by_var.items():
+        bins = np.array([row["_id"]["bin"] for row in var_rows], dtype=np.int64)
+        data_by_var[var] = {
+            "date": start + (bins * width_ms).astype("timedelta64[ms]"),
+            "avg": np.array([row["avg"] for row in var_rows], dtype=np.float64),
+            "min": np.array([row["min"] for row in var_rows], dtype=np.float64),
+            "max": np.array([row["max"] for row in var_rows], dtype=np.float64),
+            "array_len": np.array([row["array_len"] or 0 for row in var_rows], dtype=np.int64),
+        }
+    return data_by_var
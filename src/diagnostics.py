@@ -0,0 +1,104 @@
+"""Index advisor and explain-plan checks for the queries issued by `fetch_data`.
+
+Usage:
+    python -m src.diagnostics --telescope LST1 [--create-indexes]
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from src.config import TELESCOPES, DEFAULT_TELESCOPE, MAX_QUERY_TIME_MS
+from src.database import build_query, get_db, get_filtered_collections
+
+# Index every fetch relies on: equality on name, range + sort on date
+NAME_DATE_INDEX = [("name", 1), ("date", 1)]
+
+
+def _plan_stages(plan):
+    """Returns all stage names (and index names) of a winning plan tree."""
+    stages, indexes = [], []
+    nodes = [plan]
+    while nodes:
+        node = nodes.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        if "indexName" in node:
+            indexes.append(node["indexName"])
+        for child_key in ("inputStage", "queryPlan", "inputStages"):
+            child = node.get(child_key)
+            nodes.extend(child if isinstance(child, list) else [child])
+    return stages, indexes
+
+
+def explain_query(collection, query):
+    """Explains the fetch query (filter + sort on date) and summarizes its execution stats."""
+    result = collection.database.command(
+        "explain",
+        {"find": collection.name, "filter": query, "sort": {"date": 1}, "maxTimeMS": MAX_QUERY_TIME_MS},
+        verbosity="executionStats",
+    )
+    stages, indexes = _plan_stages(result.get("queryPlanner", {}).get("winningPlan", {}))
+    stats = result.get("executionStats", {})
+    return {
+        "collection": collection.name,
+        "scan": "COLLSCAN" if "COLLSCAN" in stages else ("IXSCAN" if "IXSCAN" in stages else "/".join(stages)),
+        "index": ", ".join(indexes) or None,
+        "in_memory_sort": "SORT" in stages,
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned"),
+        "time_ms": stats.get("executionTimeMillis"),
+    }
+
+
+def has_name_date_index(collection):
+    """Tells whether the collection has an index whose leading keys are (name, date)."""
+    for info in collection.index_information().values():
+        keys = [(field, abs(int(direction))) for field, direction in info["key"][:2] if isinstance(direction, (int, float))]
+        if keys == NAME_DATE_INDEX:
+            return True
+    return False
+
+
+def check_collections(db, create_missing=False, window=timedelta(days=1)):
+    """Checks every suffixed collection for the (name, date) index and explains a sample query.
+
+    The sample query asks for one variable over the last `window`, which is
+    how the app typically queries. With `create_missing`, the missing
+    indexes are built. Returns one report dict per collection.
+    """
+    end_dt = datetime.now(timezone.utc).replace(tzinfo=None)
+    reports = []
+    for name in sorted(get_filtered_collections(db)):
+        collection = db[name]
+        report = {"collection": name, "has_index": has_name_date_index(collection), "index_created": False}
+        if not report["has_index"] and create_missing:
+            collection.create_index(NAME_DATE_INDEX)
+            report["index_created"] = True
+
+        sample = collection.find_one({}, {"name": 1})
+        if sample and sample.get("name"):
+            report.update(explain_query(collection, build_query([sample["name"]], end_dt - window, end_dt)))
+        reports.append(report)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check indexes and query plans of the CaCo collections.")
+    parser.add_argument("--telescope", default=DEFAULT_TELESCOPE, choices=list(TELESCOPES))
+    parser.add_argument("--create-indexes", action="store_true", help="create the missing (name, date) indexes")
+    args = parser.parse_args()
+
+    reports = check_collections(get_db(args.telescope), create_missing=args.create_indexes)
+    print(f"{'collection':<40} {'index':<8} {'scan':<9} {'keys':>10} {'docs':>10} {'ms':>7}")
+    for report in reports:
+        index_state = "created" if report["index_created"] else ("ok" if report["has_index"] else "MISSING")
+        print(
+            f"{report['collection']:<40} {index_state:<8} {str(report.get('scan', '-')):<9} "
+            f"{str(report.get('keys_examined', '-')):>10} {str(report.get('docs_examined', '-')):>10} {str(report.get('time_ms', '-')):>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
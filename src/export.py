@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+import re
+import tempfile
+
+import pandas as pd
+
+from src.cache import clip_columns, from_ms, to_ms
+from src.config import EXPORT_FORMATS
+from src.database import doc_span, iter_batches
+from src.processor import concat_columns, expand_values_columnar, scalar_columns
+
+
+def iter_export_chunks(collection, selected_vars, start_dt, end_dt, window, cache=None, telescope=None):
+    """Yields `(var, columns)` chunks for samples in [start_dt, end_dt], one time window at a time.
+
+    Each window of each variable is read from the range cache when it is
+    fully covered there, and otherwise streamed from a batched Mongo
+    cursor. Only one window of one variable is held in memory at a time,
+    so the range can be much longer than what the interactive plot allows.
+    """
+    start_ms, end_ms = to_ms(start_dt), to_ms(end_dt) + 1
+    window_ms = int(window.total_seconds() * 1000)
+    span = doc_span(collection)
+
+    for var in selected_vars:
+        key = (telescope, collection.name, var)
+        for w_start in range(start_ms, end_ms, window_ms):
+            w_end = min(w_start + window_ms, end_ms)
+            if cache is not None and not cache.missing(key, w_start, w_end):
+                columns = cache.load(key, w_start, w_end)
+            else:
+                chunks = [
+                    expand_values_columnar(batch)
+                    for batch in iter_batches(collection, [var], from_ms(w_start) - span, from_ms(w_end))
+                ]
+                columns = clip_columns(concat_columns(chunks), w_start, w_end)
+            if len(columns["date"]):
+                yield var, columns
+
+
+def export_filename(telescope, collection_name, selected_vars, start_dt, end_dt, fmt):
+    """Returns the file name of an export, with the (sanitised) variable names in it.
+
+    Long variable lists are shortened to the first name, their number and a
+    hash of all of them, to stay within file name limits.
+    """
+    safe_vars = "+".join(re.sub(r"[^\w.-]", "_", var) for var in selected_vars)
+    if len(safe_vars) > 120:
+        digest = hashlib.sha1("\n".join(selected_vars).encode()).hexdigest()[:8]
+        safe_vars = f"{safe_vars.split('+', 1)[0][:80]}+{len(selected_vars) - 1}more_{digest}"
+    return f"{telescope}_{collection_name}_{safe_vars}_{start_dt:%Y%m%dT%H%M}_{end_dt:%Y%m%dT%H%M}{EXPORT_FORMATS[fmt]}"
+
+
+def _chunk_frame(var, columns):
+    frame = pd.DataFrame(scalar_columns(columns))
+    frame.insert(0, "name", var)
+    return frame
+
+
+def write_export(chunks, path, fmt):
+    """Writes `(var, columns)` chunks to `path` as they arrive. Returns the number of rows written.
+
+    The file is written under a temporary name next to `path` and renamed
+    once complete, so `path` never holds a partial export, even when several
+    sessions export to the same name at once.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {list(EXPORT_FORMATS)}")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path), suffix=".part")
+    os.close(fd)
+    try:
+        n_rows = _write_chunks(chunks, tmp_path, fmt)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return n_rows
+
+
+def _write_chunks(chunks, path, fmt):
+    n_rows = 0
+    if fmt == "csv":
+        with open(path, "w", newline="") as f:
+            for i, (var, columns) in enumerate(chunks):
+                _chunk_frame(var, columns).to_csv(f, header=(i == 0), index=False)
+                n_rows += len(columns["date"])
+
+    elif fmt == "ndjson.gz":
+        with gzip.open(path, "wt") as f:
+            for var, columns in chunks:
+                _chunk_frame(var, columns).to_json(f, orient="records", lines=True, date_format="iso", date_unit="ms")
+                n_rows += len(columns["date"])
+
+    elif fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise RuntimeError("Parquet export requires the 'pyarrow' package") from exc
+
+        writer = None
+        try:
+            for var, columns in chunks:
+                table = pa.Table.from_pandas(_chunk_frame(var, columns), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+                writer.write_table(table)
+                n_rows += len(columns["date"])
+        finally:
+            if writer is not None:
+                writer.close()
+
+    return n_rows
@@ -0,0 +1,93 @@
+from datetime import datetime, time, timedelta, timezone
+
+import numpy as np
+
+from src.cache import from_ms, to_ms
+from src.config import LIVE_BUFFER_SIZE, LIVE_POLL_TIME_MS
+from src.database import doc_span, iter_batches
+from src.processor import concat_columns, empty_columns, expand_values_columnar, scalar_columns
+
+
+def utc_now():
+    """Returns the current time as a naive UTC datetime, like the dates stored by CaCo."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def current_night_start(now, start_hour=17):
+    """Returns the start of the night `now` belongs to (nights start at `start_hour`)."""
+    night = now.date() if now.hour >= start_hour else now.date() - timedelta(days=1)
+    return datetime.combine(night, time(hour=start_hour))
+
+
+class ColumnRing:
+    """Fixed-capacity ring buffer of scalar columns; once full, the oldest rows are overwritten."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self._next = 0
+        self._data = {key: np.empty(capacity, dtype=col.dtype) for key, col in empty_columns().items()}
+
+    def append(self, columns):
+        """Appends date-sorted columns after the rows already held."""
+        n_rows = len(columns["date"])
+        if not n_rows:
+            return
+        if n_rows > self.capacity:
+            columns = {key: col[-self.capacity:] for key, col in columns.items()}
+            n_rows = self.capacity
+
+        idx = (self._next + np.arange(n_rows)) % self.capacity
+        for key, buf in self._data.items():
+            buf[idx] = columns[key]
+        self._next = (self._next + n_rows) % self.capacity
+        self.size = min(self.capacity, self.size + n_rows)
+
+    def columns(self):
+        """Returns a copy of the held rows, oldest first."""
+        order = (self._next - self.size + np.arange(self.size)) % self.capacity
+        return {key: buf[order] for key, buf in self._data.items()}
+
+
+class LiveTail:
+    """Follows the newest samples of some variables with small incremental queries.
+
+    The last sample time seen per variable is remembered, and each `poll`
+    only asks for documents that can hold newer samples: the document
+    containing `last_seen` (CaCo keeps filling it) and anything after. New
+    samples are appended to one `ColumnRing` of `capacity` rows per variable.
+    """
+
+    def __init__(self, collection, selected_vars, since, capacity=LIVE_BUFFER_SIZE):
+        self.collection = collection
+        self.since = since
+        self.buffers = {var: ColumnRing(capacity) for var in selected_vars}
+        self.last_seen = {var: None for var in selected_vars}
+
+    def poll(self, now=None):
+        """Fetches the samples newer than the last seen one of each variable. Returns how many were added."""
+        now = now or utc_now()
+        span = doc_span(self.collection)
+        n_new = 0
+        for var, buffer in self.buffers.items():
+            last_seen = self.last_seen[var]
+            start_dt = self.since if last_seen is None else from_ms(last_seen) - span
+            chunks = [
+                expand_values_columnar(batch)
+                for batch in iter_batches(self.collection, [var], start_dt, now, max_time_ms=LIVE_POLL_TIME_MS)
+            ]
+            columns = scalar_columns(concat_columns(chunks))
+
+            # Keep only the samples after the last one already buffered
+            first_ms = to_ms(self.since) if last_seen is None else last_seen + 1
+            lo = np.searchsorted(columns["date"].astype(np.int64), first_ms, "left")
+            columns = {key: col[lo:] for key, col in columns.items()}
+            if len(columns["date"]):
+                buffer.append(columns)
+                self.last_seen[var] = int(columns["date"][-1].astype(np.int64))
+                n_new += len(columns["date"])
+        return n_new
+
+    def columns(self):
+        """Returns the buffered columns per variable, in the `process_data_by_var` layout."""
+        return {var: buffer.columns() for var, buffer in self.buffers.items()}
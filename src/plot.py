@@ -1,10 +1,33 @@
-import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from src.config import COLORS_PLOTS, INTEGER_VARS, FSM_VARS, DICT_CACO_STATES
+from src.config import (
+    COLORS_PLOTS, INTEGER_VARS, FSM_VARS, DICT_CACO_STATES, PLOT_WIDTH_PX, DENSE_MARKER_THRESHOLD,
+    ARRAY_WORST_N, HEATMAP_MAX_CELLS, NIGHT_FOLD_BINS, CORRELATION_SCATTER_MAX, CORRELATION_BINS,
+)
+from src.processor import (
+    decimate_minmax, projection_histogram, bin_matrix, element_percentiles, worst_elements,
+    fold_nights, night_bin_means, asof_join, correlation_coefficients, density_2d,
+)
 
-def generate_plot(data_by_var, selected_vars, show_y_projection, use_night_preset, start_dt, end_dt):
+def _rgba(color, alpha):
+    """Converts a '#rrggbb' or 'rgb(r,g,b)' color to an rgba() string with the given alpha."""
+    if color.startswith('#'):
+        c_hex = color.lstrip('#')
+        r, g, b = tuple(int(c_hex[i:i+2], 16) for i in (0, 2, 4))
+        return f"rgba({r},{g},{b},{alpha})"
+    return color.replace("rgb", "rgba").replace(")", f", {alpha})")
+
+def generate_plot(data_by_var, selected_vars, show_y_projection, use_night_preset, start_dt, end_dt, var_names=None, fast_render=False):
+    """Builds the time-series figure from columns per variable.
+
+    `data_by_var` keys are used as trace labels; `var_names` optionally maps
+    a label to its variable name when they differ (e.g. "LST2 · var" in
+    telescope comparison mode). With `fast_render`, traces are drawn with
+    WebGL and each series is decimated to `PLOT_WIDTH_PX` min/max pairs.
+    """
+    var_names = var_names or {}
+    scatter = go.Scattergl if fast_render else go.Scatter
     if show_y_projection:
         fig = make_subplots(rows=1, cols=2, shared_yaxes=True, 
                             column_widths=[0.78, 0.22], specs=[[{"type":"xy"}, {"type":"xy"}]])
@@ -13,40 +36,35 @@ def generate_plot(data_by_var, selected_vars, show_y_projection, use_night_prese
 
     y_values_with_color = []
     
-    for var_idx, (var_name, var_docs) in enumerate(data_by_var.items()):
-        if not var_docs:
+    for var_idx, (var_name, cols) in enumerate(data_by_var.items()):
+        if not len(cols["date"]):
             continue
-            
-        df = pd.DataFrame(var_docs)
 
         display_name = var_name
-        if "is_array_avg" in df.columns:
-            array_size = df["is_array_avg"].iloc[0] if not df["is_array_avg"].isnull().all() else None
-            if array_size:
-                display_name = f"{var_name} (avg {int(array_size)})"
+        array_size = cols["array_len"].max()
+        if array_size:
+            display_name = f"{var_name} (avg {int(array_size)})"
 
         color = COLORS_PLOTS[var_idx % len(COLORS_PLOTS)]
-        
-        if color.startswith('#'):
-            c_hex = color.lstrip('#')
-            r, g, b = tuple(int(c_hex[i:i+2], 16) for i in (0, 2, 4))
-            rgba_color = f"rgba({r},{g},{b},0.2)"
-        else:
-            rgba_color = color.replace("rgb", "rgba").replace(")", ", 0.2)")
+        rgba_color = _rgba(color, 0.2)
 
-        show_band = "min" in df.columns and "max" in df.columns and (df["min"] != df["max"]).any()
+        show_band = bool(np.any(cols["min"] != cols["max"]))
         
         if show_y_projection:
-            y_values_with_color.append((df["avg"].values, color, var_name))
+            y_values_with_color.append((cols["avg"], color, var_name))
+
+        if fast_render:
+            cols = decimate_minmax(cols, PLOT_WIDTH_PX)
+        mode = "lines" if len(cols["date"]) > DENSE_MARKER_THRESHOLD else "lines+markers"
         
         col_idx = 1 if show_y_projection else None
 
         if show_band:
-            fig.add_trace(go.Scatter(x=df["date"], y=df["max"], mode="lines", line=dict(width=0, shape="hv"), showlegend=False, hoverinfo="skip"), row=1 if show_y_projection else None, col=col_idx)
-            fig.add_trace(go.Scatter(x=df["date"], y=df["min"], mode="lines", fill="tonexty", fillcolor=rgba_color, line=dict(width=0, shape="hv"), showlegend=False, hoverinfo="skip"), row=1 if show_y_projection else None, col=col_idx)
+            fig.add_trace(scatter(x=cols["date"], y=cols["max"], mode="lines", line=dict(width=0, shape="hv"), showlegend=False, hoverinfo="skip"), row=1 if show_y_projection else None, col=col_idx)
+            fig.add_trace(scatter(x=cols["date"], y=cols["min"], mode="lines", fill="tonexty", fillcolor=rgba_color, line=dict(width=0, shape="hv"), showlegend=False, hoverinfo="skip"), row=1 if show_y_projection else None, col=col_idx)
         
-        fig.add_trace(go.Scatter(
-            x=df["date"], y=df["avg"], mode="lines+markers", 
+        fig.add_trace(scatter(
+            x=cols["date"], y=cols["avg"], mode=mode, 
             line_shape="hv", marker=dict(size=6),  
             name=display_name, 
             line=dict(color=color, width=2)
@@ -62,21 +80,15 @@ def generate_plot(data_by_var, selected_vars, show_y_projection, use_night_prese
     if show_y_projection and y_values_with_color:
         for vals, color, var_name in y_values_with_color:
             rgba_color_hist = color.replace("rgb", "rgba").replace(")", ", 0.4)")
-            v_min, v_max = np.min(vals), np.max(vals)
-            v_range = v_max - v_min
-            is_int_var = var_name in INTEGER_VARS or var_name in FSM_VARS or np.all(np.mod(vals, 1) == 0)
-
-            if is_int_var:
-                bin_size, start_val, end_val = 1.0, np.floor(v_min) - 0.5, np.ceil(v_max) + 0.5
-            else:
-                bin_size, start_val, end_val = (v_range / 40.0) if v_range != 0 else 0.1, v_min, v_max
-
-            fig.add_trace(go.Histogram(
-                y=vals, orientation="h", ybins=dict(start=start_val, end=end_val, size=bin_size),
-                marker=dict(color=rgba_color_hist, line=dict(color=color, width=1)),  
-                name=f"{var_name} (hist)", showlegend=False, hoverinfo="y+name",
+            base_var = var_names.get(var_name, var_name)
+            centers, counts, bin_size = projection_histogram(vals, integer_bins=base_var in INTEGER_VARS or base_var in FSM_VARS)
+
+            fig.add_trace(go.Bar(
+                y=centers, x=counts, orientation="h", width=bin_size * 0.95,
+                marker=dict(color=rgba_color_hist, line=dict(color=color, width=1)),
+                name=f"{var_name} (hist)", showlegend=False, hoverinfo="x+y+name",
             ), row=1, col=2)
-            
+
         fig.update_xaxes(showticklabels=False, row=1, col=2)
 
     # Y-Axis Logic
@@ -91,4 +103,113 @@ def generate_plot(data_by_var, selected_vars, show_y_projection, use_night_prese
         except Exception:
             fig.update_xaxes(range=[start_dt.isoformat(), end_dt.isoformat()])
 
-    return fig
\ No newline at end of file
+    return fig
+
+def generate_array_plot(var_name, cols, n_worst=ARRAY_WORST_N):
+    """Per-element summary of an array variable: 5-95% band and median across elements plus the worst elements."""
+    dates, matrix = bin_matrix(cols["date"], cols["matrix"], PLOT_WIDTH_PX)
+    p5, p50, p95 = element_percentiles(matrix, (5, 50, 95))
+
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(x=dates, y=p95, mode="lines", line=dict(width=0), showlegend=False, hoverinfo="skip"))
+    fig.add_trace(go.Scattergl(
+        x=dates, y=p5, mode="lines", fill="tonexty", fillcolor="rgba(0,51,102,0.2)", line=dict(width=0),
+        name="5-95% of elements",
+    ))
+    fig.add_trace(go.Scattergl(x=dates, y=p50, mode="lines", line=dict(color=COLORS_PLOTS[0], width=2), name="median"))
+    for i, element in enumerate(worst_elements(matrix, n_worst)):
+        fig.add_trace(go.Scattergl(
+            x=dates, y=matrix[:, element], mode="lines",
+            line=dict(color=COLORS_PLOTS[(i + 2) % len(COLORS_PLOTS)], width=1), name=f"element {element}",
+        ))
+
+    fig.update_layout(
+        title_text=f"{var_name}: spread across {matrix.shape[1]} elements", xaxis_title="Time UTC", yaxis_title="Value",
+        hovermode="x unified", height=400, legend=dict(title_text=""),
+    )
+    return fig
+
+
+def generate_array_heatmap(var_name, cols):
+    """Time x element heatmap of an array variable, time-binned so it stays below `HEATMAP_MAX_CELLS`."""
+    n_elements = cols["matrix"].shape[1]
+    n_bins = max(10, HEATMAP_MAX_CELLS // max(n_elements, 1))
+    dates, matrix = bin_matrix(cols["date"], cols["matrix"], n_bins)
+
+    fig = go.Figure(go.Heatmap(
+        x=dates, y=np.arange(n_elements), z=matrix.T, colorscale="Viridis",
+        colorbar=dict(title="Value"), hovertemplate="%{x}<br>element %{y}<br>%{z}<extra></extra>",
+    ))
+    fig.update_layout(title_text=f"{var_name}: elements over time", xaxis_title="Time UTC", yaxis_title="Element", height=500)
+    return fig
+
+
+def generate_night_plot(data_by_var, night_starts, night_hours, mode="envelope"):
+    """Overlays several nights on a common "hours since night start" axis.
+
+    Each variable is folded onto the nights starting at `night_starts` and
+    averaged into `NIGHT_FOLD_BINS` bins over `night_hours`. `mode="overlay"`
+    draws one line per night; `mode="envelope"` draws the 5-95% band and the
+    median across nights.
+    """
+    fig = go.Figure()
+    for var_idx, (var_name, cols) in enumerate(data_by_var.items()):
+        if not len(cols["date"]):
+            continue
+        color = COLORS_PLOTS[var_idx % len(COLORS_PLOTS)]
+        night_idx, hours = fold_nights(cols["date"], night_starts)
+        centers, means = night_bin_means(night_idx, hours, cols["avg"], len(night_starts), night_hours, NIGHT_FOLD_BINS)
+
+        if mode == "overlay":
+            shown = False
+            for night_start, night_means in zip(night_starts, means):
+                if np.all(np.isnan(night_means)):
+                    continue
+                fig.add_trace(go.Scattergl(
+                    x=centers, y=night_means, mode="lines", line=dict(color=_rgba(color, 0.45), width=1),
+                    name=var_name, legendgroup=var_name, showlegend=not shown,
+                    hovertemplate=f"{night_start:%Y-%m-%d}: %{{y}}<extra>{var_name}</extra>",
+                ))
+                shown = True
+        else:
+            p5, p50, p95 = element_percentiles(means.T, (5, 50, 95))
+            fig.add_trace(go.Scattergl(x=centers, y=p95, mode="lines", line=dict(width=0), showlegend=False, hoverinfo="skip", legendgroup=var_name))
+            fig.add_trace(go.Scattergl(
+                x=centers, y=p5, mode="lines", fill="tonexty", fillcolor=_rgba(color, 0.2), line=dict(width=0),
+                name=f"{var_name} 5-95% of nights", legendgroup=var_name,
+            ))
+            fig.add_trace(go.Scattergl(x=centers, y=p50, mode="lines", line=dict(color=color, width=2), name=f"{var_name} median", legendgroup=var_name))
+
+    fig.update_layout(
+        title_text=f"{len(night_starts)} nights", xaxis_title="Hours since night start", yaxis_title="Value",
+        hovermode="x unified", height=400, legend=dict(title_text=""),
+    )
+    fig.update_xaxes(range=[0, night_hours])
+    return fig
+
+
+def generate_correlation_plot(x_label, x_cols, y_label, y_cols):
+    """Plots one variable against another, aligned in time with `asof_join`.
+
+    Up to `CORRELATION_SCATTER_MAX` pairs are drawn as points; more are
+    binned into a `CORRELATION_BINS` x `CORRELATION_BINS` density histogram
+    first, so the figure size does not grow with the range. Returns the
+    figure and the `correlation_coefficients` of the pairs.
+    """
+    dates, x, y = asof_join(x_cols, y_cols)
+    stats = correlation_coefficients(x, y)
+
+    if len(x) <= CORRELATION_SCATTER_MAX:
+        fig = go.Figure(go.Scattergl(
+            x=x, y=y, mode="markers", marker=dict(size=4, color=COLORS_PLOTS[0], opacity=0.6), customdata=dates,
+            hovertemplate=f"%{{customdata|%Y-%m-%d %H:%M:%S}}<br>{x_label}: %{{x}}<br>{y_label}: %{{y}}<extra></extra>",
+        ))
+    else:
+        x_centers, y_centers, counts = density_2d(x, y, CORRELATION_BINS)
+        fig = go.Figure(go.Heatmap(
+            x=x_centers, y=y_centers, z=np.where(counts > 0, counts, np.nan), colorscale="Viridis",
+            colorbar=dict(title="Samples"), hovertemplate=f"{x_label}: %{{x}}<br>{y_label}: %{{y}}<br>%{{z}} samples<extra></extra>",
+        ))
+
+    fig.update_layout(title_text=f"{y_label} vs {x_label} ({stats['n']:,} time-aligned samples)", xaxis_title=x_label, yaxis_title=y_label, height=500)
+    return fig, stats
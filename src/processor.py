@@ -1,47 +1,433 @@
+import warnings
+from datetime import datetime, time, timedelta
+
 import numpy as np
-from datetime import timedelta
 
-def expand_values_field(docs):
-    expanded = []
+
+def empty_columns():
+    """Returns an empty set of columns for one variable."""
+    return {
+        "date": np.empty(0, dtype="datetime64[ms]"),
+        "avg": np.empty(0, dtype=np.float64),
+        "min": np.empty(0, dtype=np.float64),
+        "max": np.empty(0, dtype=np.float64),
+        "array_len": np.empty(0, dtype=np.int64),
+    }
+
+
+def scalar_columns(columns):
+    """Returns the one-dimensional columns only (drops the per-element `matrix`)."""
+    return {key: col for key, col in columns.items() if col.ndim == 1}
+
+
+def _to_float_array(values):
+    """Converts a list of scalars to float64, turning unparsable entries into NaN."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        out = np.full(len(values), np.nan)
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except (ValueError, TypeError):
+                pass
+        return out
+
+
+def _array_means(samples):
+    """Returns the per-sample nanmean, element count and, if rectangular, the float32 matrix of array samples."""
+    try:
+        matrix = np.array(samples, dtype=np.float32)
+    except (ValueError, TypeError):
+        matrix = None
+
+    if matrix is not None and matrix.ndim == 2:
+        counts = np.sum(~np.isnan(matrix), axis=1)
+        sums = np.nansum(matrix, axis=1, dtype=np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        return means, np.full(len(samples), matrix.shape[1], dtype=np.int64), matrix
+
+    # Ragged arrays: fall back to one mean per sample
+    means = np.full(len(samples), np.nan)
+    lengths = np.zeros(len(samples), dtype=np.int64)
+    for i, sample in enumerate(samples):
+        arr = _to_float_array(list(sample))
+        lengths[i] = len(arr)
+        if len(arr) and not np.all(np.isnan(arr)):
+            means[i] = np.nanmean(arr)
+    return means, lengths, None
+
+
+def expand_values_columnar(docs):
+    """Expands the per-second `values` field of a list of documents into columns.
+
+    Returns a dict of NumPy arrays: `date` (datetime64[ms]), `avg`, `min`,
+    `max` (float64) and `array_len` (number of elements for array-valued
+    samples, 0 for scalars), sorted by date. Array samples are reduced to
+    their mean, so `min == max == avg` for them; when every sample is an
+    array of the same length, the full time x element values are also kept
+    as a float32 `matrix` column. Documents without a
+    `values` map (pre-aggregated collections) contribute one row each from
+    their own `avg`/`min`/`max` fields.
+    """
+    base_dates, counts, seconds, samples = [], [], [], []
+    flat_dates, flat_avg, flat_min, flat_max, flat_len = [], [], [], [], []
+
     for doc in docs:
-        if "values" in doc and isinstance(doc["values"], dict):
-            base_date = doc.get("date")
-            if base_date:
-                for second_str, value in doc["values"].items():
-                    try:
-                        second = int(second_str)
-                        new_doc = doc.copy()
-                        new_doc["date"] = base_date + timedelta(seconds=second)
-                        
-                        if isinstance(value, (list, np.ndarray)):
-                            arr = np.array(value)
-                            array_mean = np.nanmean(arr)
-                            new_doc["avg"] = array_mean
-                            new_doc["min"] = array_mean
-                            new_doc["max"] = array_mean
-                            new_doc["is_array_avg"] = len(arr)
-                        else:
-                            new_doc["avg"] = value
-                            new_doc["min"] = value
-                            new_doc["max"] = value
-                            new_doc["is_array_avg"] = None
-                            
-                        expanded.append(new_doc)
-                    except (ValueError, TypeError):
-                        pass
-        else:
-            expanded.append(doc)
-    return expanded
+        values = doc.get("values")
+        base_date = doc.get("date")
+        if isinstance(values, dict):
+            if base_date and values:
+                base_dates.append(base_date)
+                counts.append(len(values))
+                seconds.extend(values.keys())
+                samples.extend(values.values())
+        elif base_date:
+            flat_dates.append(base_date)
+            flat_avg.append(doc.get("avg"))
+            flat_min.append(doc.get("min", doc.get("avg")))
+            flat_max.append(doc.get("max", doc.get("avg")))
+            flat_len.append(doc.get("array_len") or 0)
+
+    if not samples and not flat_dates:
+        return empty_columns()
+
+    # Expanded samples: base date of each doc repeated once per second offset
+    offsets = _to_float_array(seconds)
+    valid = np.isfinite(offsets) & (offsets == np.floor(offsets))
+    dates = np.repeat(np.array(base_dates, dtype="datetime64[ms]"), counts)
+    dates = dates + (np.where(valid, offsets, 0).astype(np.int64) * 1000).astype("timedelta64[ms]")
+
+    is_array = np.fromiter((isinstance(s, (list, tuple, np.ndarray)) for s in samples), dtype=bool, count=len(samples))
+    avg = np.full(len(samples), np.nan)
+    array_len = np.zeros(len(samples), dtype=np.int64)
+    matrix = None
+    if is_array.all() and samples:
+        avg, array_len, matrix = _array_means(samples)
+    elif is_array.any():
+        idx = np.flatnonzero(is_array)
+        avg[idx], array_len[idx], _ = _array_means([samples[i] for i in idx])
+    if not is_array.all():
+        idx = np.flatnonzero(~is_array)
+        avg[idx] = _to_float_array([samples[i] for i in idx])
+
+    columns = {
+        "date": np.concatenate([dates[valid], np.array(flat_dates, dtype="datetime64[ms]")]),
+        "avg": np.concatenate([avg[valid], _to_float_array(flat_avg)]),
+        "min": np.concatenate([avg[valid], _to_float_array(flat_min)]),
+        "max": np.concatenate([avg[valid], _to_float_array(flat_max)]),
+        "array_len": np.concatenate([array_len[valid], np.array(flat_len, dtype=np.int64)]),
+    }
+    if matrix is not None and not flat_dates:
+        columns["matrix"] = matrix[valid]
+
+    order = np.argsort(columns["date"], kind="stable")
+    return {key: col[order] for key, col in columns.items()}
+
 
 def process_data_by_var(all_data, selected_vars):
-    """Groups data by variable and expands the values field."""
-    data_by_var = {var: [] for var in selected_vars}
+    """Groups data by variable and expands the values field into columns."""
+    docs_by_var = {var: [] for var in selected_vars}
     for doc in all_data:
         var_name = doc.get("name")
-        if var_name in data_by_var:
-            data_by_var[var_name].append(doc)
+        if var_name in docs_by_var:
+            docs_by_var[var_name].append(doc)
+
+    return {var: expand_values_columnar(docs_by_var[var]) for var in selected_vars}
+
+
+def concat_columns(chunks):
+    """Concatenates column chunks of one variable, keeping them sorted by date."""
+    chunks = [chunk for chunk in chunks if len(chunk["date"])]
+    if not chunks:
+        return empty_columns()
+    if len(chunks) == 1:
+        return chunks[0]
+
+    # The matrix column is only kept if every chunk has one of the same width
+    keys = [key for key in chunks[0] if all(key in chunk for chunk in chunks)]
+    if "matrix" in keys and len({chunk["matrix"].shape[1] for chunk in chunks}) > 1:
+        keys.remove("matrix")
+    columns = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in keys}
+    if np.any(columns["date"][1:] < columns["date"][:-1]):
+        order = np.argsort(columns["date"], kind="stable")
+        columns = {key: col[order] for key, col in columns.items()}
+    return columns
+
+
+class ColumnAccumulator:
+    """Expands batches of documents as they arrive and collects the columns per variable."""
+
+    def __init__(self, selected_vars):
+        self.chunks = {var: [] for var in selected_vars}
+        self.n_docs = 0
+
+    def add(self, docs):
+        """Expands one batch of documents and stores its columns."""
+        self.n_docs += len(docs)
+        for var, columns in process_data_by_var(docs, list(self.chunks)).items():
+            if len(columns["date"]):
+                self.chunks[var].append(columns)
+
+    def result(self):
+        """Returns the columns collected so far, in the `process_data_by_var` layout."""
+        self.chunks = {var: [concat_columns(chunks)] for var, chunks in self.chunks.items()}
+        return {var: chunks[0] for var, chunks in self.chunks.items()}
+
+
+def _time_bins(dates, n_bins):
+    """Splits sorted dates into `n_bins` equal time bins.
+
+    Returns the bin of each row, the index of the first row of each
+    non-empty bin and the group (non-empty bin number) of each row.
+    """
+    t = dates.astype(np.int64)
+    span = max(int(t[-1] - t[0]), 1)
+    bins = np.minimum((t - t[0]) * n_bins // span, n_bins - 1)
+    is_start = np.r_[True, bins[1:] != bins[:-1]]
+    return bins, np.flatnonzero(is_start), np.cumsum(is_start) - 1
+
+
+def decimate_minmax(columns, n_bins):
+    """Reduces columns to at most `2 * n_bins` rows for plotting.
+
+    The time range is split into `n_bins` equal bins (one per pixel) and, in
+    each bin, only the rows holding the lowest and highest `avg` are kept,
+    so spikes survive. The `min`/`max` of the kept rows are widened to the
+    extremes of their bin, so the band still covers every sample.
+    """
+    n_rows = len(columns["date"])
+    if n_rows <= 2 * n_bins:
+        return columns
+
+    bins, starts, group = _time_bins(columns["date"], n_bins)
+
+    # Rows are sorted by date, so sorting by (bin, value) keeps bin groups in place
+    avg = columns["avg"]
+    low_first = np.lexsort((np.where(np.isnan(avg), np.inf, avg), bins))
+    high_first = np.lexsort((np.where(np.isnan(avg), np.inf, -avg), bins))
+    keep = np.union1d(low_first[starts], high_first[starts])
+
+    decimated = {key: col[keep] for key, col in columns.items()}
+    decimated["min"] = np.fmin.reduceat(columns["min"], starts)[group[keep]]
+    decimated["max"] = np.fmax.reduceat(columns["max"], starts)[group[keep]]
+    return decimated
+
+
+def projection_histogram(vals, integer_bins=False):
+    """Bins values for the Y-axis projection.
+
+    Integer-valued data (or `integer_bins=True`) gets unit bins centred on
+    the integers; anything else gets 40 bins spanning the data range (a
+    single 0.1-wide bin if the data is constant). NaNs are ignored.
+    Returns `(centers, counts, bin_size)`.
+    """
+    vals = vals[np.isfinite(vals)]
+    if not len(vals):
+        return np.empty(0), np.empty(0, dtype=np.int64), 1.0
+
+    v_min, v_max = vals.min(), vals.max()
+    v_range = v_max - v_min
+    if integer_bins or np.all(np.mod(vals, 1) == 0):
+        bin_size, start_val, end_val = 1.0, np.floor(v_min) - 0.5, np.ceil(v_max) + 0.5
+    else:
+        bin_size, start_val, end_val = (v_range / 40.0) if v_range != 0 else 0.1, v_min, v_max
+
+    n_bins = max(1, int(np.ceil((end_val - start_val) / bin_size - 1e-9)))
+    edges = start_val + bin_size * np.arange(n_bins + 1)
+    # Rounding can leave the last edge just below the maximum, which would drop it
+    edges[-1] = max(edges[-1], end_val)
+    counts, _ = np.histogram(vals, bins=edges)
+    return edges[:-1] + bin_size / 2, counts, bin_size
+
+
+def bin_matrix(dates, matrix, n_bins):
+    """Averages a time x element matrix into at most `n_bins` time bins, ignoring NaNs.
+
+    Returns the date of the first sample of each bin and the float32 binned matrix.
+    """
+    if len(dates) <= n_bins:
+        return dates, matrix
+
+    _, starts, _ = _time_bins(dates, n_bins)
+    valid = ~np.isnan(matrix)
+    sums = np.add.reduceat(np.where(valid, matrix, 0), starts, axis=0, dtype=np.float64)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        binned = np.where(counts > 0, sums / counts, np.nan).astype(np.float32)
+    return dates[starts], binned
+
+
+def element_percentiles(matrix, percentiles=(5, 50, 95)):
+    """Returns the percentiles across elements at each time, shape (len(percentiles), n_times)."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanpercentile(matrix, percentiles, axis=1)
+
+
+def worst_elements(matrix, n):
+    """Returns the indices of the `n` elements that deviate most from the camera median.
+
+    The score of an element is its mean absolute deviation from the median
+    across all elements at the same time.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(matrix, axis=1, keepdims=True)
+        score = np.nanmean(np.abs(matrix - median), axis=0)
+    score = np.where(np.isnan(score), -np.inf, score)
+    return np.argsort(score)[::-1][:n]
+
+
+def night_ranges(first_night, last_night, start_hour=17, end_hour=8):
+    """Returns the `(start_dt, end_dt)` of every night from `first_night` to `last_night`, inclusive.
+
+    A night starts at `start_hour` of its date and ends at `end_hour`, on the
+    next day when `end_hour <= start_hour`.
+    """
+    ranges = []
+    night = first_night
+    while night <= last_night:
+        end_day = night + timedelta(days=1 if end_hour <= start_hour else 0)
+        ranges.append((datetime.combine(night, time(hour=start_hour)), datetime.combine(end_day, time(hour=end_hour))))
+        night += timedelta(days=1)
+    return ranges
+
+
+def fold_nights(dates, night_starts):
+    """Folds sample dates onto the nights they belong to.
+
+    `night_starts` are the sorted start times of the nights. Returns, for
+    each sample, the index of the last night starting at or before it (-1
+    before the first night) and the hours elapsed since that night's start.
+    """
+    t = dates.astype("datetime64[ms]").astype(np.int64)
+    starts = np.asarray(night_starts, dtype="datetime64[ms]").astype(np.int64)
+    night_idx = np.searchsorted(starts, t, "right") - 1
+    hours = (t - starts[np.maximum(night_idx, 0)]) / 3.6e6
+    return night_idx, hours
+
+
+def night_bin_means(night_idx, hours, values, n_nights, night_hours, n_bins):
+    """Averages folded samples into a nights x `n_bins` grid spanning `night_hours`.
+
+    Returns the bin centers (hours since night start) and the float64 grid,
+    NaN where a night has no finite sample in a bin.
+    """
+    valid = (night_idx >= 0) & (night_idx < n_nights) & (hours >= 0) & (hours < night_hours) & np.isfinite(values)
+    cells = night_idx[valid] * n_bins + (hours[valid] * n_bins / night_hours).astype(np.int64)
+    sums = np.bincount(cells, weights=values[valid], minlength=n_nights * n_bins)
+    counts = np.bincount(cells, minlength=n_nights * n_bins)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan).reshape(n_nights, n_bins)
+    centers = (np.arange(n_bins) + 0.5) * night_hours / n_bins
+    return centers, means
+
+
+def table_page(data_by_var, page_size, cursor=None, descending=False, value_range=(None, None)):
+    """Returns one page of the rows of several variables, merged in date order.
+
+    Keyset pagination: `cursor` is the `(date_ms, name, row)` of the last
+    row of the previous page (None for the first page), and each variable
+    is sought with `searchsorted`, so a page costs the same wherever it is.
+    Ties on date are broken by variable name, then row. Rows whose `avg` falls
+    outside `value_range` (either bound may be None) are skipped.
+    Returns `(page, next_cursor, n_rows)`: the page columns with a `name`
+    column, the cursor of the next page (None on the last page) and the
+    number of matching rows.
+    """
+    names, takes, n_rows, n_after = [], [], 0, 0
+    for name, cols in sorted(data_by_var.items()):
+        idx = np.arange(len(cols["date"]))
+        value_min, value_max = value_range
+        if value_min is not None or value_max is not None:
+            avg = cols["avg"]
+            mask = np.isfinite(avg)
+            if value_min is not None:
+                mask &= avg >= value_min
+            if value_max is not None:
+                mask &= avg <= value_max
+            idx = np.flatnonzero(mask)
+        dates = cols["date"][idx].astype(np.int64)
+        n_rows += len(idx)
+
+        lo, hi = 0, len(idx)
+        if cursor is not None:
+            cursor_ms, cursor_name, cursor_row = cursor
+            if name == cursor_name:
+                # Rows are in date order, so the row index alone locates the cursor
+                if descending:
+                    hi = np.searchsorted(idx, cursor_row, "left")
+                else:
+                    lo = np.searchsorted(idx, cursor_row, "right")
+            elif descending:
+                hi = np.searchsorted(dates, cursor_ms, "right" if name < cursor_name else "left")
+            else:
+                lo = np.searchsorted(dates, cursor_ms, "left" if name > cursor_name else "right")
+        n_after += hi - lo
+        names.append(name)
+        takes.append(idx[max(lo, hi - page_size):hi] if descending else idx[lo:lo + page_size])
+
+    columns = [scalar_columns(data_by_var[name]) for name in names]
+    keys = [key for key in empty_columns() if all(key in cols for cols in columns)]
+    merged = {key: np.concatenate([cols[key][take] for cols, take in zip(columns, takes)]) for key in keys}
+    rows = np.concatenate(takes)
+    rank = np.repeat(np.arange(len(names)), [len(take) for take in takes])
+    dates = merged["date"].astype(np.int64)
+    order = np.lexsort((-rows, -rank, -dates) if descending else (rows, rank, dates))[:page_size]
+
+    page = {"name": np.array(names, dtype=object)[rank[order]], **{key: col[order] for key, col in merged.items()}}
+    next_cursor = None
+    if n_after > page_size:
+        next_cursor = (int(dates[order[-1]]), page["name"][-1], int(rows[order[-1]]))
+    return page, next_cursor, n_rows
+
+
+def asof_join(left, right, tolerance_ms=None):
+    """Aligns two variables: each `left` sample gets the last `right` sample at or before it.
+
+    Pairs further apart than `tolerance_ms` (default: 1.5x the median
+    sampling interval of `right`) or with a non-finite avg are dropped.
+    Returns the dates and the left and right values of the pairs.
+    """
+    t_left = left["date"].astype("datetime64[ms]").astype(np.int64)
+    t_right = right["date"].astype("datetime64[ms]").astype(np.int64)
+    if not len(t_left) or not len(t_right):
+        return left["date"][:0], np.empty(0), np.empty(0)
+    if tolerance_ms is None:
+        tolerance_ms = 1.5 * np.median(np.diff(t_right)) if len(t_right) > 1 else 0
+
+    idx = np.searchsorted(t_right, t_left, "right") - 1
+    matched = np.maximum(idx, 0)
+    valid = (idx >= 0) & (t_left - t_right[matched] <= tolerance_ms)
+    x, y = left["avg"][valid], right["avg"][matched[valid]]
+    finite = np.isfinite(x) & np.isfinite(y)
+    return left["date"][valid][finite], x[finite], y[finite]
+
+
+def average_ranks(values):
+    """Ranks values from 0, giving tied values the mean of their ranks."""
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    starts = np.cumsum(counts) - counts
+    return (starts + (counts - 1) / 2)[inverse]
+
+
+def correlation_coefficients(x, y):
+    """Returns the number of pairs and the Pearson and Spearman coefficients (None when undefined)."""
+    def pearson(a, b):
+        if len(a) < 2 or np.std(a) == 0 or np.std(b) == 0:
+            return None
+        return float(np.corrcoef(a, b)[0, 1])
+
+    return {"n": len(x), "pearson": pearson(x, y), "spearman": pearson(average_ranks(x), average_ranks(y))}
+
+
+def density_2d(x, y, n_bins):
+    """Counts (x, y) pairs on an `n_bins` x `n_bins` grid over their range.
 
-    for var in selected_vars:
-        data_by_var[var] = expand_values_field(data_by_var[var])
-        
-    return data_by_var
\ No newline at end of file
+    Returns the bin centers along x and y and the counts, shaped (y, x) for
+    a heatmap.
+    """
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=n_bins)
+    return (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2, counts.T
@@ -0,0 +1,152 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import numpy as np
+
+from src.cache import to_ms
+
+
+def result_key(kind, telescope, collection_name, selected_vars, ranges):
+    """Returns the cache key of a query result, independent of the variable order and datetime types."""
+    return (
+        kind, telescope, collection_name, tuple(sorted(set(selected_vars))),
+        tuple((to_ms(start_dt), to_ms(end_dt)) for start_dt, end_dt in ranges),
+    )
+
+
+def _arrays(value):
+    """Yields the NumPy arrays nested in dicts, lists and tuples of a result."""
+    if isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _arrays(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _arrays(item)
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.ok = False
+
+
+class ResultCache:
+    """In-process cache of query results, shared by every session of the app.
+
+    Entries are evicted least recently used first once their arrays exceed
+    `max_bytes`. Mutable entries also expire `ttl_s` seconds after being
+    stored, immutable ones (ranges that CaCo will not write to anymore)
+    only by eviction. Concurrent requests for a key that is being computed
+    wait for that computation instead of running their own. Cached arrays
+    are made read-only, since every session gets the same objects.
+    """
+
+    def __init__(self, max_bytes, ttl_s):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0}
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires"] is not None and monotonic() > entry["expires"]:
+            self._remove(key)
+            self._counters["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)["nbytes"]
+
+    def get(self, key):
+        """Returns the cached value of `key`, or None."""
+        with self._lock:
+            entry = self._lookup(key)
+            self._counters["hits" if entry else "misses"] += 1
+            return entry["value"] if entry else None
+
+    def put(self, key, value, immutable=False):
+        """Stores a value, evicting the least recently used entries beyond the byte budget."""
+        arrays = list(_arrays(value))
+        nbytes = sum(arr.nbytes for arr in arrays)
+        if nbytes > self.max_bytes:
+            return
+        for arr in arrays:
+            arr.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "value": value, "nbytes": nbytes, "expires": None if immutable else monotonic() + self.ttl_s,
+            }
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def get_or_compute(self, key, compute, immutable=False, cacheable=None):
+        """Returns the cached value of `key`, computing and storing it on a miss.
+
+        Only one caller computes a missing key; the others wait for it and
+        get its value, or its exception. A value for which `cacheable(value)`
+        is false is returned without being stored.
+        """
+        while True:
+            with self._lock:
+                entry = self._lookup(key)
+                if entry is not None:
+                    self._counters["hits"] += 1
+                    return entry["value"]
+                in_flight = self._in_flight.get(key)
+                owner = in_flight is None
+                if owner:
+                    in_flight = self._in_flight[key] = _InFlight()
+                    self._counters["misses"] += 1
+                else:
+                    self._counters["coalesced"] += 1
+
+            if not owner:
+                in_flight.done.wait()
+                if in_flight.ok:
+                    return in_flight.value
+                if in_flight.error is not None:
+                    raise in_flight.error
+                # The computing caller was interrupted (e.g. its script was stopped): try again
+                continue
+
+            try:
+                value = compute()
+                if cacheable is None or cacheable(value):
+                    self.put(key, value, immutable)
+                in_flight.value, in_flight.ok = value, True
+                return value
+            except Exception as exc:
+                in_flight.error = exc
+                raise
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                in_flight.done.set()
+
+    def stats(self):
+        """Returns the hit/miss counters, the hit ratio and the current size."""
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"] + self._counters["coalesced"]
+            return {
+                **self._counters,
+                "hit_ratio": (self._counters["hits"] + self._counters["coalesced"]) / lookups if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "in_flight": len(self._in_flight),
+            }
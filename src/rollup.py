@@ -0,0 +1,243 @@
+"""Incremental rollup of `{base}_min` into `{base}_hour`, `{base}_day` and `{base}_week`.
+
+Usage (e.g. from cron, every few minutes):
+    python -m src.rollup --telescope LST1 [--base camera] [--rebuild]
+
+Each level is built from the one below it (_min -> _hour -> _day -> _week)
+and only buckets that are complete and past `ROLLUP_SETTLE_TIME` are
+written, in the same document shape CaCo uses (see `DOC_SPAN_S` and
+`SAMPLE_PERIOD_S`). A watermark per target collection, stored in
+`ROLLUP_STATE_COLLECTION`, records up to where it is built. A target that
+already has documents but no watermark is written by CaCo itself: it is
+left alone and used as the source of the next level. `--rebuild` only
+drops the collections this job owns. Needs MongoDB >= 5.0 (`$dateTrunc`).
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+
+from src.config import (
+    TELESCOPES, DEFAULT_TELESCOPE, MAX_QUERY_TIME_MS, ROLLUP_STATE_COLLECTION, ROLLUP_SETTLE_TIME,
+    ROLLUP_STEP_BUCKETS, SAMPLE_PERIOD_S, DOC_SPAN_S,
+)
+from src.database import get_db
+
+# (source suffix, target suffix, $dateTrunc unit of one target document), finest first
+ROLLUP_CHAIN = [("_min", "_hour", "hour"), ("_hour", "_day", "day"), ("_day", "_week", "week")]
+
+
+class RollupTargetExists(Exception):
+    """Raised when a rollup target has documents but no watermark, i.e. it was not written by this job."""
+
+
+def truncate(dt, unit):
+    """Returns the start of the hour/day/week (weeks start on Monday) containing `dt`."""
+    if unit == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day - timedelta(days=day.weekday()) if unit == "week" else day
+
+
+def build_rollup_pipeline(names, start_dt, end_dt, unit, target_suffix, target):
+    """Builds the aggregation that rolls [start_dt, end_dt) of a source collection into `target`.
+
+    The output has the native CaCo shape of `target_suffix`: one document
+    per (name, `unit`) holding a `values` map keyed by second offsets every
+    `SAMPLE_PERIOD_S[target_suffix]`. Each entry is the mean of the source
+    samples in that period, element-wise for array samples. Since the map
+    only keeps means, each document also gets the `min`/`max` of its source
+    samples (array samples by their mean, source `min`/`max` where present)
+    and the largest `array_len`. Documents are upserted into `target` with
+    `$merge`, so re-running a window replaces them.
+    """
+    period_s = SAMPLE_PERIOD_S[target_suffix]
+    return [
+        {"$match": {"name": {"$in": list(names)}, "date": {"$gte": start_dt, "$lt": end_dt}}},
+        {"$project": {
+            "name": 1, "date": 1, "min": 1, "max": 1, "array_len": 1,
+            "sample": {"$objectToArray": "$values"},
+        }},
+        {"$unwind": "$sample"},
+        {"$set": {"sample_mean": {"$cond": [{"$isArray": "$sample.v"}, {"$avg": "$sample.v"}, "$sample.v"]}}},
+        {"$project": {
+            "name": 1,
+            "t": {"$add": ["$date", {"$multiply": [
+                {"$convert": {"input": "$sample.k", "to": "long", "onError": None, "onNull": None}}, 1000,
+            ]}]},
+            "v": "$sample.v",
+            "is_array": {"$isArray": "$sample.v"},
+            "lo": {"$ifNull": ["$min", "$sample_mean"]},
+            "hi": {"$ifNull": ["$max", "$sample_mean"]},
+            "array_len": {"$cond": [{"$isArray": "$sample.v"}, {"$size": "$sample.v"}, {"$ifNull": ["$array_len", 0]}]},
+        }},
+        {"$match": {"t": {"$ne": None}}},
+        {"$set": {"doc_date": {"$dateTrunc": {"date": "$t", "unit": unit, "startOfWeek": "monday"}}}},
+        {"$set": {"offset": {"$toLong": {"$multiply": [
+            {"$floor": {"$divide": [{"$subtract": ["$t", "$doc_date"]}, period_s * 1000]}}, period_s,
+        ]}}}},
+        # Scalars unwind to themselves (index null), arrays to one row per element
+        {"$unwind": {"path": "$v", "includeArrayIndex": "i"}},
+        {"$group": {
+            "_id": {"name": "$name", "date": "$doc_date", "offset": "$offset", "i": "$i"},
+            "v": {"$avg": "$v"},
+            "is_array": {"$max": "$is_array"},
+            "lo": {"$min": "$lo"},
+            "hi": {"$max": "$hi"},
+            "array_len": {"$max": "$array_len"},
+        }},
+        {"$sort": {"_id.i": 1}},
+        {"$group": {
+            "_id": {"name": "$_id.name", "date": "$_id.date", "offset": "$_id.offset"},
+            "v": {"$push": "$v"},
+            "is_array": {"$max": "$is_array"},
+            "lo": {"$min": "$lo"},
+            "hi": {"$max": "$hi"},
+            "array_len": {"$max": "$array_len"},
+        }},
+        {"$group": {
+            "_id": {"name": "$_id.name", "date": "$_id.date"},
+            "values": {"$push": {
+                "k": {"$toString": "$_id.offset"},
+                "v": {"$cond": ["$is_array", "$v", {"$arrayElemAt": ["$v", 0]}]},
+            }},
+            "min": {"$min": "$lo"},
+            "max": {"$max": "$hi"},
+            "array_len": {"$max": "$array_len"},
+        }},
+        {"$project": {
+            "_id": 0, "name": "$_id.name", "date": "$_id.date", "values": {"$arrayToObject": "$values"},
+            "min": 1, "max": 1, "array_len": 1,
+        }},
+        {"$merge": {"into": target, "on": ["name", "date"], "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+def get_watermark(db, target):
+    """Returns the date up to which `target` is built (exclusive), or None if it never was."""
+    state = db[ROLLUP_STATE_COLLECTION].find_one({"_id": target})
+    return state["watermark"] if state else None
+
+
+def set_watermark(db, target, watermark):
+    db[ROLLUP_STATE_COLLECTION].update_one(
+        {"_id": target},
+        {"$set": {"watermark": watermark, "updated": datetime.now(timezone.utc).replace(tzinfo=None)}},
+        upsert=True,
+    )
+
+
+def _edge_date(collection, names, direction=pymongo.ASCENDING):
+    """Returns the earliest (or with DESCENDING, latest) document date of the given names, one (name, date) index lookup each."""
+    dates = [
+        doc["date"]
+        for doc in (collection.find_one({"name": name}, {"date": 1}, sort=[("date", direction)]) for name in names)
+        if doc and doc.get("date")
+    ]
+    if not dates:
+        return None
+    return min(dates) if direction == pymongo.ASCENDING else max(dates)
+
+
+def is_foreign(db, target):
+    """Tells whether `target` has documents but no watermark, i.e. it is written by CaCo and not by this job."""
+    return get_watermark(db, target) is None and db[target].find_one({}, {"_id": 1}) is not None
+
+
+def rollup_level(db, base, source_suffix, target_suffix, unit, ready_until):
+    """Brings `{base}{target_suffix}` up to the last complete bucket before `ready_until`.
+
+    Works forward from the stored watermark (or the first source date) in
+    steps of `ROLLUP_STEP_BUCKETS` buckets, saving the watermark after each
+    step so an interrupted run resumes where it stopped. Returns the new
+    watermark, or None if the source is empty.
+    """
+    source, target = db[f"{base}{source_suffix}"], f"{base}{target_suffix}"
+    names = [name for name in source.distinct("name") if name is not None]
+    watermark = get_watermark(db, target)
+    if watermark is None:
+        if db[target].find_one({}, {"_id": 1}) is not None:
+            raise RollupTargetExists(f"{target} has documents but no rollup watermark")
+        first = _edge_date(source, names)
+        if first is None:
+            return None
+        watermark = truncate(first, unit)
+        # $merge needs a unique index on its `on` fields; it also serves the app queries
+        db[target].create_index([("name", pymongo.ASCENDING), ("date", pymongo.ASCENDING)], unique=True)
+        # Claims the empty target, so an interrupted first step is resumed rather than refused
+        set_watermark(db, target, watermark)
+
+    upto = truncate(ready_until, unit)
+    step = timedelta(seconds=DOC_SPAN_S[target_suffix]) * ROLLUP_STEP_BUCKETS
+    while watermark < upto:
+        window_end = min(watermark + step, upto)
+        source.aggregate(
+            build_rollup_pipeline(names, watermark, window_end, unit, target_suffix, target),
+            maxTimeMS=10 * MAX_QUERY_TIME_MS, allowDiskUse=True,
+        )
+        set_watermark(db, target, window_end)
+        watermark = window_end
+    return watermark
+
+
+def rollup_base(db, base, now=None):
+    """Runs the whole rollup chain of one base collection.
+
+    Levels written by CaCo (see `is_foreign`) are skipped but still feed the
+    next level, up to their latest document. Returns `{target: watermark}`,
+    with None as the watermark of skipped levels.
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    ready_until = now - ROLLUP_SETTLE_TIME
+    watermarks = {}
+    for source_suffix, target_suffix, unit in ROLLUP_CHAIN:
+        target = f"{base}{target_suffix}"
+        if is_foreign(db, target):
+            # Documents before CaCo's latest one are complete
+            latest = _edge_date(db[target], [name for name in db[target].distinct("name") if name is not None], pymongo.DESCENDING)
+            watermarks[target] = None
+            ready_until = min(ready_until, latest) if latest else ready_until
+            continue
+        watermark = rollup_level(db, base, source_suffix, target_suffix, unit, ready_until)
+        if watermark is None:
+            break
+        watermarks[target] = watermark
+        # A coarser bucket is only complete once the level below covers it
+        ready_until = watermark
+    return watermarks
+
+
+def drop_rollups(db, base):
+    """Drops the rollup collections this job owns (those with a watermark) and their watermarks, so the next run rebuilds them.
+
+    Collections written by CaCo are never touched. Returns the dropped names.
+    """
+    targets = [f"{base}{target}" for _, target, _ in ROLLUP_CHAIN if get_watermark(db, f"{base}{target}") is not None]
+    for target in targets:
+        db.drop_collection(target)
+    db[ROLLUP_STATE_COLLECTION].delete_many({"_id": {"$in": targets}})
+    return targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the _hour/_day/_week rollups of the CaCo _min collections.")
+    parser.add_argument("--telescope", default=DEFAULT_TELESCOPE, choices=list(TELESCOPES))
+    parser.add_argument("--base", action="append", help="base collection name (repeatable); default: every *_min collection")
+    parser.add_argument("--rebuild", action="store_true", help="drop the _hour/_day/_week collections built by this job and rebuild them from the first minute")
+    args = parser.parse_args()
+
+    db = get_db(args.telescope)
+    bases = args.base or sorted(name[:-len("_min")] for name in db.list_collection_names() if name.endswith("_min"))
+    for base in bases:
+        if args.rebuild:
+            drop_rollups(db, base)
+        watermarks = rollup_base(db, base)
+        summary = ", ".join(
+            f"{target} to {watermark:%Y-%m-%d %H:%M}" if watermark else f"{target} written by CaCo"
+            for target, watermark in watermarks.items()
+        )
+        print(f"{base}: {summary or 'no data'}")
+
+
+if __name__ == "__main__":
+    main()
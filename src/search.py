@@ -0,0 +1,93 @@
+"""Server-side search of the time intervals where variables go out of range.
+
+Conditions map each variable to `(low, high)` bounds, either of which may be
+None: a sample matches when its max is above `high` or its min is below
+`low`. MongoDB matches the samples, merges consecutive matches into
+intervals with `$setWindowFields` (MongoDB >= 5.0) and returns one small
+row per interval, so even month- or year-long searches transfer a few rows.
+"""
+from datetime import timedelta
+
+from pymongo.errors import ExecutionTimeout
+
+from src.config import MAX_QUERY_TIME_MS, SAMPLE_PERIOD_S, SEARCH_MERGE_GAP, SEARCH_MAX_INTERVALS
+from src.database import QueryTimeout, build_query, sample_stages
+
+
+def _bound_filters(low, high, skip_unsummarized=False):
+    """Filters matching rows outside (low, high), on their `min`/`max` fields.
+
+    With `skip_unsummarized`, documents that lack the field of a bound are
+    kept too, since only their samples can tell.
+    """
+    filters = []
+    if high is not None:
+        filters.append({"max": {"$gt": high}})
+        if skip_unsummarized:
+            filters.append({"max": {"$exists": False}})
+    if low is not None:
+        filters.append({"min": {"$lt": low}})
+        if skip_unsummarized:
+            filters.append({"min": {"$exists": False}})
+    return filters
+
+
+def build_interval_pipeline(conditions, start_dt, end_dt, gap_ms, max_intervals=SEARCH_MAX_INTERVALS):
+    """Builds the aggregation returning the out-of-range intervals of each variable.
+
+    Documents whose own min/max are within the bounds are dropped before
+    their samples are unwound. Matching samples less than `gap_ms` apart
+    belong to the same interval.
+    """
+    conditions = {var: bounds for var, bounds in conditions.items() if any(bound is not None for bound in bounds)}
+    doc_filters = [{"name": var, "$or": _bound_filters(low, high, skip_unsummarized=True)} for var, (low, high) in conditions.items()]
+    sample_filters = [{"name": var, "$or": _bound_filters(low, high)} for var, (low, high) in conditions.items()]
+    by_time = {"partitionBy": "$name", "sortBy": {"t": 1}}
+    return [
+        {"$match": {**build_query(list(conditions), start_dt, end_dt), "$or": doc_filters}},
+        *sample_stages(),
+        {"$match": {"t": {"$gte": start_dt, "$lte": end_dt}, "$or": sample_filters}},
+        {"$setWindowFields": {**by_time, "output": {"prev_t": {"$shift": {"output": "$t", "by": -1}}}}},
+        {"$set": {"starts_interval": {"$cond": [
+            {"$or": [{"$eq": ["$prev_t", None]}, {"$gt": [{"$subtract": ["$t", "$prev_t"]}, gap_ms]}]}, 1, 0,
+        ]}}},
+        {"$setWindowFields": {**by_time, "output": {"interval": {
+            "$sum": "$starts_interval", "window": {"documents": ["unbounded", "current"]},
+        }}}},
+        {"$group": {
+            "_id": {"name": "$name", "interval": "$interval"},
+            "start": {"$min": "$t"},
+            "last": {"$max": "$t"},
+            "min": {"$min": "$min"},
+            "max": {"$max": "$max"},
+            "samples": {"$sum": 1},
+        }},
+        {"$sort": {"start": 1}},
+        {"$limit": max_intervals},
+    ]
+
+
+def find_intervals(collection, conditions, start_dt, end_dt, merge_gap=SEARCH_MERGE_GAP, max_intervals=SEARCH_MAX_INTERVALS):
+    """Returns `{var: [interval, ...]}` for the variables of `conditions`, earliest first.
+
+    Each interval holds its start, end (last matching sample plus one
+    sampling period), duration, number of samples and min/max value.
+    At most `max_intervals` intervals are returned in total. Raises
+    `QueryTimeout` if the search runs longer than `MAX_QUERY_TIME_MS`.
+    """
+    period = timedelta(seconds=SAMPLE_PERIOD_S.get("_" + collection.name.rsplit("_", 1)[-1], 0))
+    gap_ms = int((period + merge_gap).total_seconds() * 1000)
+    pipeline = build_interval_pipeline(conditions, start_dt, end_dt, gap_ms, max_intervals)
+    try:
+        rows = list(collection.aggregate(pipeline, maxTimeMS=MAX_QUERY_TIME_MS, allowDiskUse=True))
+    except ExecutionTimeout as exc:
+        raise QueryTimeout("Interval search exceeded maximum execution time. Please narrow the range or the conditions.") from exc
+
+    intervals = {var: [] for var in conditions}
+    for row in rows:
+        end = min(row["last"] + period, end_dt)
+        intervals[row["_id"]["name"]].append({
+            "start": row["start"], "end": end, "duration": end - row["start"],
+            "samples": row["samples"], "min": row["min"], "max": row["max"],
+        })
+    return intervals
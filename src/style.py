@@ -1,13 +1,19 @@
 import base64
+from functools import lru_cache
+
 import streamlit as st
 from src.config import LOGO_PATH, ICON_PATH
 
+@lru_cache(maxsize=None)
 def get_base64(bin_file):
+    """Returns the base64 encoding of a file, read once per process."""
     with open(bin_file, "rb") as f:
         return base64.b64encode(f.read()).decode()
 
-def apply_custom_styles():
-    st.markdown(f"""
+@lru_cache(maxsize=None)
+def _custom_css():
+    """Builds the app stylesheet once; it embeds the logo, so it is not rebuilt on every rerun."""
+    return f"""
         <style>
             /* Main Layout */
             .stApp {{ background-color: #ffffff; color: #001F54; }}
@@ -110,6 +116,11 @@ def apply_custom_styles():
             .telescope-btn.lst4 {{ background-color: rgba(138,43,226,0.06); color: #8A2BE2; }}
             .telescope-btn.lst4.selected {{ color: #8A2BE2; background-color: rgba(138,43,226,0.06); }}
 
+            .telescope-btn.down {{ opacity: 0.4; text-decoration: line-through !important; }}
+
             .stMarkdown span[style*="color: #FF4B4B;"] {{ color: #003366 !important; font-weight: bold; }}
         </style>
-    """, unsafe_allow_html=True)
+    """
+
+def apply_custom_styles():
+    st.markdown(_custom_css(), unsafe_allow_html=True)
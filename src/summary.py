@@ -0,0 +1,115 @@
+"""Server-side statistics of variables over a time range, without transferring their documents.
+
+Each variable is reduced by MongoDB to its number of samples, min, max,
+mean, standard deviation and approximate percentiles (see `sample_stages`).
+For `FSM_VARS`, the time spent in each `DICT_CACO_STATES` state is added:
+every sample lasts until the next one (or the end of the range).
+"""
+from pymongo.errors import ExecutionTimeout, OperationFailure
+
+from src.config import DICT_CACO_STATES, FSM_VARS, MAX_QUERY_TIME_MS, SUMMARY_PERCENTILES
+from src.database import QueryTimeout, build_query, sample_stages
+
+
+def _sample_rows(selected_vars, start_dt, end_dt):
+    """Stages selecting the samples of the variables that fall in [start_dt, end_dt]."""
+    return [
+        {"$match": build_query(selected_vars, start_dt, end_dt)},
+        *sample_stages(),
+        {"$match": {"t": {"$gte": start_dt, "$lte": end_dt}}},
+    ]
+
+
+def build_stats_pipeline(selected_vars, start_dt, end_dt, percentiles=SUMMARY_PERCENTILES):
+    """Builds the aggregation returning one statistics document per variable.
+
+    `$percentile` needs MongoDB >= 7.0; pass no `percentiles` to leave it out.
+    """
+    group = {
+        "_id": "$name",
+        "samples": {"$sum": 1},
+        "min": {"$min": "$min"},
+        "max": {"$max": "$max"},
+        "mean": {"$avg": "$avg"},
+        "std": {"$stdDevPop": "$avg"},
+        "first": {"$min": "$t"},
+        "last": {"$max": "$t"},
+    }
+    if percentiles:
+        group["percentiles"] = {"$percentile": {"input": "$avg", "p": list(percentiles), "method": "approximate"}}
+    return [*_sample_rows(selected_vars, start_dt, end_dt), {"$group": group}]
+
+
+def build_state_time_pipeline(selected_vars, start_dt, end_dt):
+    """Builds the aggregation returning the time spent in each state per variable.
+
+    `$setWindowFields` pairs each sample with the next one of the same
+    variable; the state (the sample avg, rounded) lasts until then. Needs
+    MongoDB >= 5.0.
+    """
+    return [
+        *_sample_rows(selected_vars, start_dt, end_dt),
+        {"$setWindowFields": {
+            "partitionBy": "$name",
+            "sortBy": {"t": 1},
+            "output": {"next_t": {"$shift": {"output": "$t", "by": 1, "default": end_dt}}},
+        }},
+        {"$group": {
+            "_id": {"name": "$name", "state": {"$round": ["$avg", 0]}},
+            "duration_ms": {"$sum": {"$subtract": [{"$min": ["$next_t", end_dt]}, "$t"]}},
+            "samples": {"$sum": 1},
+        }},
+        {"$sort": {"_id.name": 1, "_id.state": 1}},
+    ]
+
+
+def _aggregate(collection, pipeline):
+    try:
+        return list(collection.aggregate(pipeline, maxTimeMS=MAX_QUERY_TIME_MS, allowDiskUse=True))
+    except ExecutionTimeout as exc:
+        raise QueryTimeout("Summary query exceeded maximum execution time. Please narrow your filters.") from exc
+
+
+def fetch_summary(collection, selected_vars, start_dt, end_dt, percentiles=SUMMARY_PERCENTILES):
+    """Returns `{var: {"stats": {...}, "states": [...] or None}}` computed on the server.
+
+    `stats` holds the number of samples, min, max, mean, std, the requested percentiles (None
+    if the server is older than 7.0) and the first/last sample time.
+    `states` lists, for `FSM_VARS`, the time and fraction of time spent in
+    each state. Raises `QueryTimeout` if a query runs longer than
+    `MAX_QUERY_TIME_MS`.
+    """
+    percentiles = list(percentiles or [])
+    try:
+        rows = _aggregate(collection, build_stats_pipeline(selected_vars, start_dt, end_dt, percentiles))
+    except OperationFailure:
+        # $percentile is not available before MongoDB 7.0
+        rows = _aggregate(collection, build_stats_pipeline(selected_vars, start_dt, end_dt, None))
+
+    summary = {var: {"stats": None, "states": None} for var in selected_vars}
+    for row in rows:
+        if row["_id"] not in summary:
+            continue
+        values = row.get("percentiles") or [None] * len(percentiles)
+        summary[row["_id"]]["stats"] = {
+            "samples": row["samples"], "min": row["min"],
+            **{f"p{round(p * 100):g}": value for p, value in zip(percentiles, values)},
+            "max": row["max"], "mean": row["mean"], "std": row["std"], "first": row["first"], "last": row["last"],
+        }
+
+    fsm_vars = [var for var in selected_vars if var in FSM_VARS]
+    if fsm_vars:
+        for var in fsm_vars:
+            summary[var]["states"] = []
+        for row in _aggregate(collection, build_state_time_pipeline(fsm_vars, start_dt, end_dt)):
+            state = row["_id"]["state"]
+            summary[row["_id"]["name"]]["states"].append({
+                "state": DICT_CACO_STATES.get(int(state), str(state)) if state is not None else "unknown",
+                "duration_ms": row["duration_ms"],
+                "samples": row["samples"],
+            })
+        for var in fsm_vars:
+            total_ms = sum(row["duration_ms"] for row in summary[var]["states"])
+            for row in summary[var]["states"]:
+                row["fraction"] = row["duration_ms"] / total_ms if total_ms else None
+    return summary
@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+from src.cache import RangeCache
+
+
+def make_columns(start_s, end_s):
+    dates_ms = np.arange(start_s, end_s) * 1000
+    return {
+        "date": dates_ms.astype("datetime64[ms]"),
+        "avg": dates_ms / 1000.0,
+        "min": dates_ms / 1000.0,
+        "max": dates_ms / 1000.0,
+        "array_len": np.zeros(len(dates_ms), dtype=np.int64),
+    }
+
+
+def test_overlapping_stores_do_not_duplicate_rows(tmp_path):
+    cache = RangeCache(str(tmp_path), max_bytes=10**9)
+    key = ("LST1", "camera_min", "T")
+    cache.store(key, 0, 100_000, make_columns(0, 100))
+    cache.store(key, 50_000, 150_000, make_columns(50, 150))
+
+    columns = cache.load(key, 0, 150_000)
+    assert len(columns["date"]) == 150
+    assert len(np.unique(columns["date"])) == 150
+    assert cache.missing(key, 0, 150_000) == []
+
+
+def test_eviction_keeps_the_cache_under_budget(tmp_path, monkeypatch):
+    cache = RangeCache(str(tmp_path), max_bytes=10**9)
+    chunk_bytes = None
+    for i in range(3):
+        cache.store(("LST1", "camera_min", f"V{i}"), 0, 100_000, make_columns(0, 100))
+        chunk_bytes = chunk_bytes or sum(f.stat().st_size for f in tmp_path.rglob("*.npz"))
+
+    # The tree is walked once, later stores use the running total
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(os, "walk", lambda *args, **kwargs: walks.append(args) or real_walk(*args, **kwargs))
+    cache.max_bytes = 2 * chunk_bytes
+    cache.store(("LST1", "camera_min", "V3"), 0, 100_000, make_columns(0, 100))
+    assert walks == []
+
+    remaining = sorted(path.name.split("-")[0] for path in (tmp_path / "LST1" / "camera_min").iterdir())
+    assert remaining == ["V2", "V3"]
+
+
+def _load_many(root, key, n):
+    cache = RangeCache(root, max_bytes=10**9)
+    for _ in range(n):
+        assert len(cache.load(key, 0, 100_000)["date"]) == 100
+
+
+def test_processes_share_the_cache(tmp_path):
+    key = ("LST1", "camera_min", "T")
+    RangeCache(str(tmp_path), max_bytes=10**9).store(key, 0, 100_000, make_columns(0, 100))
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_load_many, args=(str(tmp_path), key, 50)) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0] * 8
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from src.export import export_filename, write_export
+
+
+def make_columns(n):
+    avg = np.arange(n, dtype=np.float64)
+    return {
+        "date": (np.arange(n) * 1000).astype("datetime64[ms]"),
+        "avg": avg,
+        "min": avg,
+        "max": avg,
+        "array_len": np.zeros(n, dtype=np.int64),
+    }
+
+
+def test_export_filename_names_the_variables():
+    start, end = datetime(2026, 1, 1), datetime(2026, 1, 2)
+    name_a = export_filename("LST1", "camera_min", ["T/1", "A"], start, end, "csv")
+    name_b = export_filename("LST1", "camera_min", ["B"], start, end, "csv")
+    assert name_a == "LST1_camera_min_T_1+A_20260101T0000_20260102T0000.csv"
+    assert name_a != name_b
+
+    many = [f"variable_with_a_long_name_{i}" for i in range(50)]
+    name = export_filename("LST1", "camera_min", many, start, end, "parquet")
+    assert len(name) < 200
+    assert name != export_filename("LST1", "camera_min", many[:-1], start, end, "parquet")
+
+
+def test_write_export_leaves_no_partial_file(tmp_path):
+    path = tmp_path / "out.csv"
+    assert write_export([("T", make_columns(5))], str(path), "csv") == 5
+    assert path.read_text().count("\n") == 6
+
+    def failing_chunks():
+        yield "T", make_columns(3)
+        raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        write_export(failing_chunks(), str(path), "csv")
+    assert path.read_text().count("\n") == 6
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["out.csv"]
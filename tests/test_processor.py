@@ -0,0 +1,77 @@
+import numpy as np
+
+from src.processor import decimate_minmax, projection_histogram, table_page
+
+
+def make_columns(dates_ms, avg):
+    avg = np.asarray(avg, dtype=np.float64)
+    return {
+        "date": np.asarray(dates_ms, dtype="datetime64[ms]"),
+        "avg": avg,
+        "min": avg - 1,
+        "max": avg + 1,
+        "array_len": np.zeros(len(avg), dtype=np.int64),
+    }
+
+
+def test_projection_histogram_counts_every_value():
+    _, counts, _ = projection_histogram(np.array([2.467, 2.859, 6.499, 1.658]))
+    assert counts.sum() == 4
+
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        vals = rng.uniform(-10, 10, size=rng.integers(2, 50))
+        assert projection_histogram(vals)[1].sum() == len(vals)
+
+
+def test_projection_histogram_integer_and_constant_data():
+    centers, counts, bin_size = projection_histogram(np.array([4.0, 6.0, 6.0, np.nan]))
+    assert bin_size == 1.0
+    assert list(centers) == [4.0, 5.0, 6.0]
+    assert list(counts) == [1, 0, 2]
+
+    assert projection_histogram(np.array([1.5, 1.5]))[1].sum() == 2
+
+
+def test_decimate_minmax_keeps_extremes():
+    avg = np.sin(np.arange(10_000) / 50.0)
+    avg[1234], avg[8765] = 5.0, -5.0
+    columns = make_columns(np.arange(10_000) * 1000, avg)
+
+    decimated = decimate_minmax(columns, 100)
+    assert len(decimated["date"]) <= 200
+    assert decimated["avg"].max() == 5.0
+    assert decimated["avg"].min() == -5.0
+    assert decimated["max"].max() == columns["max"].max()
+    assert decimated["min"].min() == columns["min"].min()
+    assert np.all(np.diff(decimated["date"].astype(np.int64)) > 0)
+
+
+def _all_pages(data_by_var, page_size, descending=False):
+    rows, cursor = [], None
+    while True:
+        page, cursor, n_rows = table_page(data_by_var, page_size, cursor, descending)
+        rows += list(zip(page["date"].astype(np.int64), page["name"], page["avg"]))
+        if cursor is None:
+            return rows, n_rows
+
+
+def test_table_page_walks_every_row_once_in_order():
+    data_by_var = {
+        "B": make_columns([1, 2, 2, 5, 7], [0, 1, 2, 3, 4]),
+        "A": make_columns([2, 3, 5, 6], [10, 11, 12, 13]),
+    }
+    ascending, n_rows = _all_pages(data_by_var, 2)
+    descending, _ = _all_pages(data_by_var, 2, descending=True)
+
+    assert n_rows == 9
+    assert sorted(ascending) == sorted(descending) and len(set(ascending)) == 9
+    assert [row[0] for row in ascending] == [1, 2, 2, 2, 3, 5, 5, 6, 7]
+    assert descending == ascending[::-1]
+
+
+def test_table_page_value_filter():
+    data_by_var = {"A": make_columns([1, 2, 3, 4], [1, 5, 9, 5])}
+    page, cursor, n_rows = table_page(data_by_var, 10, value_range=(4, 6))
+    assert n_rows == 2 and cursor is None
+    assert list(page["avg"]) == [5, 5]